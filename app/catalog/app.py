@@ -1,19 +1,34 @@
+import json
+import math
 import os
 import time
+from contextvars import ContextVar
 from flask import Flask, jsonify
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from sqlalchemy import create_engine, text
+from prometheus_client import Counter, Histogram
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import NullPool, QueuePool
 
 from contextlib import contextmanager
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.logger import setup_logger
+from utils.json_provider import install_json_provider
+from utils.startup import DependencyInitializer
+from utils.metrics import metrics_response
+from utils.health import HEALTH_CHECK_TIMEOUT, HealthMonitor
+from utils.admission import install_admission
+from utils.tracing import CLIENT, install_tracing
+from utils.resilience import CircuitBreaker, DependencyUnavailable, install_resilience, remaining
 
 # Initialize Flask app
 app = Flask(__name__)
+install_json_provider(app)
+install_admission(app, 'catalog')
+install_resilience(app, 'catalog')
 
 # Initialize logger
 logger = setup_logger('catalog')
+tracer = install_tracing(app, 'catalog', logger)
 
 # Metrics
 REQUEST_COUNT = Counter(
@@ -31,105 +46,216 @@ DB_PORT = os.getenv('POSTGRES_PORT', '5432')
 DB_NAME = os.getenv('POSTGRES_DB', 'postgres')
 DB_USER = os.getenv('POSTGRES_USER', 'postgres')
 DB_PASS = os.getenv('POSTGRES_PASSWORD', '')
-MAX_RETRIES = int(os.getenv('DB_MAX_RETRIES', '10'))
-RETRY_DELAY = int(os.getenv('DB_RETRY_DELAY', '5'))
+# Upper bounds for a single database call, requests are further limited by their deadline
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '2'))
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', '2'))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '5000'))
+# Each product's stock is split over this many rows so concurrent reservations by the
+# order service lock different rows; it applies when a product is first stocked
+INVENTORY_SHARDS = int(os.getenv('INVENTORY_SHARDS', '8'))
+CATALOGUE_FILE = 'data/catalogue_data.json'
 
 def wait_for_db():
-    """Wait for database to become available"""
-    logger.info("Waiting for database to become available...")
+    """Check that the database host resolves, raising if it does not"""
     import socket
-    
-    for attempt in range(MAX_RETRIES):
-        try:
-            socket.gethostbyname(DB_HOST)
-            logger.info(f"Database host {DB_HOST} resolved successfully")
-            return True
-        except socket.gaierror as e:
-            logger.warning(f"Database host resolution attempt {attempt + 1} failed: {str(e)}")
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(RETRY_DELAY)
-    
-    logger.error("Failed to resolve database host")
-    return False
 
-# SQLAlchemy setup with retry logic
+    socket.gethostbyname(DB_HOST)
+    logger.info(f"Database host {DB_HOST} resolved successfully")
+
+# SQLAlchemy setup, the engine connects lazily so creating it never blocks
+DB_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Seconds the current checkout may wait, set by get_db_connection from the request deadline
+checkout_timeout = ContextVar('checkout_timeout', default=None)
+
+class DeadlineQueuePool(QueuePool):
+    """QueuePool whose checkout waits at most checkout_timeout, when one is set"""
+
+    @property
+    def _timeout(self):
+        timeout = checkout_timeout.get()
+        return self._pool_timeout if timeout is None else timeout
+
+    @_timeout.setter
+    def _timeout(self, value):
+        self._pool_timeout = value
+
+def bound_connect_timeout(dialect, conn_rec, cargs, cparams):
+    """New connections opened during a checkout wait at most checkout_timeout"""
+    timeout = checkout_timeout.get()
+    if timeout is not None and dialect.name == 'postgresql':
+        # libpq rounds timeouts under 2 seconds up to 2
+        cparams['connect_timeout'] = min(DB_CONNECT_TIMEOUT, max(1, math.ceil(timeout)))
+
 def get_db_engine():
-    """Create SQLAlchemy engine with retry logic"""
-    if not wait_for_db():
-        logger.error("Database host resolution failed")
-        # raise Exception("Database host resolution failed") # TODO: ensure that the database is ready before starting the service
-        
-    url = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-    return create_engine(
-        url,
+    """Create SQLAlchemy engine"""
+    engine = create_engine(
+        DB_URL,
+        poolclass=DeadlineQueuePool,
         pool_pre_ping=True,
         pool_size=5,
         max_overflow=10,
-        pool_timeout=30,
+        pool_timeout=DB_POOL_TIMEOUT,
         pool_recycle=1800,
         connect_args={
-            'connect_timeout': 10
+            'connect_timeout': DB_CONNECT_TIMEOUT,
+            'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
         }
     )
+    event.listen(engine, 'do_connect', bound_connect_timeout)
+    return engine
 
-# Initialize engine after waiting for database
+# Created by init_database on the startup thread, or lazily by the first request
 engine = None
 
+def dispose_engine_after_fork():
+    """Drop pooled connections inherited from the gunicorn master (preload_app)"""
+    if engine is not None:
+        engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=dispose_engine_after_fork)
+
+db_breaker = CircuitBreaker('catalog', 'database')
+
 @contextmanager
 def get_db_connection():
-    """Context manager for database connections with retry logic"""
+    """
+    Context manager for pooled database connections, fails fast instead of retrying:
+    raises CircuitOpenError while the database circuit is open and DeadlineExceeded
+    once the request deadline has passed. The checkout and the connection's first
+    transaction may only take the time left before the deadline.
+    """
     global engine
     if engine is None:
         engine = get_db_engine()
-        
-    retries = 3
-    delay = 2
-    last_exception = None
-    
-    for attempt in range(retries):
-        try:
+    # Waiting for a pooled connection and opening a new one are bounded by the time left
+    token = checkout_timeout.set(remaining('database', DB_POOL_TIMEOUT))
+    try:
+        # Only the checkout counts against the database, errors in the caller's block don't
+        with db_breaker:
             connection = engine.connect()
-            try:
-                yield connection
-                return
-            finally:
-                connection.close()
-        except Exception as e:
-            last_exception = e
-            logger.warning(f"Database connection attempt {attempt + 1} failed: {str(e)}")
-            if attempt < retries - 1:
-                time.sleep(delay * (attempt + 1))
-    
-    logger.error(f"All database connection attempts failed: {str(last_exception)}")
-    # raise last_exception # TODO: ensure that the database is ready before starting the service
+    finally:
+        checkout_timeout.reset(token)
+    try:
+        statement_timeout = remaining('database', DB_STATEMENT_TIMEOUT_MS / 1000)
+        # The benchmark stand-in is SQLite, which has no statement timeout
+        if statement_timeout < DB_STATEMENT_TIMEOUT_MS / 1000 and connection.dialect.name == 'postgresql':
+            connection.execute(
+                text("SELECT set_config('statement_timeout', :timeout, true)"),
+                {"timeout": str(max(1, int(statement_timeout * 1000)))}
+            )
+        yield connection
+    finally:
+        connection.close()
+
+def init_database():
+    """Startup step: resolve the database host and run a test query"""
+    wait_for_db()
+    with get_db_connection() as conn:
+        conn.execute(text("SELECT 1"))
+    logger.info("Database connection successful")
+
+def init_inventory():
+    """Startup step: create the stock table and stock catalogue products that have none yet"""
+    with open(CATALOGUE_FILE) as f:
+        products = json.load(f)
+    with get_db_connection() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS inventory_shards (
+                product VARCHAR(255) NOT NULL,
+                shard INTEGER NOT NULL,
+                available INTEGER NOT NULL CHECK (available >= 0),
+                PRIMARY KEY (product, shard)
+            )
+        """))
+        for product in products:
+            stocked = conn.execute(
+                text("SELECT COUNT(*) FROM inventory_shards WHERE product = :product"),
+                {"product": product['name']}
+            ).scalar()
+            if stocked:
+                continue
+            share, extra = divmod(product.get('stock', 0), INVENTORY_SHARDS)
+            conn.execute(
+                text(
+                    "INSERT INTO inventory_shards (product, shard, available) "
+                    "VALUES (:product, :shard, :available) ON CONFLICT (product, shard) DO NOTHING"
+                ),
+                [
+                    {"product": product['name'], "shard": shard, "available": share + (shard < extra)}
+                    for shard in range(INVENTORY_SHARDS)
+                ]
+            )
+        conn.commit()
+    logger.info("Inventory initialized successfully")
+
+# Dependencies are initialized in the background, see /readyz
+initializer = DependencyInitializer('catalog', logger)
+initializer.add_step('database', init_database)
+initializer.add_step('inventory', init_inventory)
+
+# Unpooled connections bounded by HEALTH_CHECK_TIMEOUT, so a probe never waits on
+# the request pool and a slow database is reported within the timeout
+health_engine = None
+
+def check_database():
+    """Health check: connect and run a test query"""
+    global health_engine
+    if health_engine is None:
+        health_engine = create_engine(
+            DB_URL,
+            poolclass=NullPool,
+            connect_args={
+                'connect_timeout': max(1, int(HEALTH_CHECK_TIMEOUT)),
+                'options': f'-c statement_timeout={int(HEALTH_CHECK_TIMEOUT * 1000)}'
+            }
+        )
+    with health_engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return "connected"
+
+# Dependencies are probed in the background, /health serves the cached results
+health_monitor = HealthMonitor('catalog', logger)
+health_monitor.add_check('database', check_database)
+
+@app.route('/livez')
+def livez():
+    """Liveness probe: the process is up and serving requests"""
+    return jsonify({"status": "alive"}), 200
+
+@app.route('/readyz')
+def readyz():
+    """Readiness probe: every dependency has been initialized"""
+    if initializer.ready():
+        return jsonify({"status": "ready"}), 200
+    return jsonify({"status": "initializing", "dependencies": initializer.status()}), 503
 
 @app.route('/health')
 def health():
-    """Health check endpoint"""
-    logger.info("Health check endpoint called - catalog service")
-    try:
-        # Test database connection
-        with get_db_connection() as conn:
-            conn.execute(text("SELECT 1"))
-            return jsonify({
-                "status": "healthy",
-                "database": "connected"
-            }), 200
-    except Exception as e:
-        logger.error(f"Health check failed: {str(e)}")
+    """Health check endpoint, serves the latest cached dependency checks"""
+    logger.info("Health check endpoint called - catalog service", extra={"sample_key": "/health"})
+    checks = health_monitor.snapshot()
+    database = checks["database"]["status"]
+    if database == "disconnected":
         return jsonify({
             "status": "unhealthy",
-            "database": "disconnected",
-            "error": str(e)
+            "database": database,
+            "error": checks["database"]["error"],
+            "checks": checks
         }), 500
+    return jsonify({
+        "status": "healthy",
+        "database": database,
+        "checks": checks
+    }), 200
 
 @app.route('/metrics')
 def metrics():
     """
     Metrics endpoint for Prometheus
     """
-    logger.info("Metrics endpoint called - catalog service")
-    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+    logger.info("Metrics endpoint called - catalog service", extra={"sample_key": "/metrics"})
+    return metrics_response()
 
 @app.route('/')
 def index():
@@ -141,25 +267,45 @@ def index():
         "message": "Catalog Service Running!"
     }), 200
 
+@app.route('/inventory/<product>')
+def product_inventory(product):
+    """Stock left for a product, summed over its shards"""
+    start_time = time.time()
+    try:
+        with tracer.span('postgres.inventory', kind=CLIENT, attributes={"db.system": "postgresql"}), \
+                get_db_connection() as conn:
+            shards, available = conn.execute(
+                text("SELECT COUNT(*), COALESCE(SUM(available), 0) FROM inventory_shards WHERE product = :product"),
+                {"product": product}
+            ).one()
+        REQUEST_LATENCY.labels(app_name='catalog', endpoint='/inventory').observe(time.time() - start_time)
+        if not shards:
+            REQUEST_COUNT.labels(app_name='catalog', method='GET', endpoint='/inventory', http_status=404).inc()
+            return jsonify({"error": f"Unknown product: {product}"}), 404
+        REQUEST_COUNT.labels(app_name='catalog', method='GET', endpoint='/inventory', http_status=200).inc()
+        return jsonify({"product": product, "available": available, "shards": shards}), 200
+
+    except DependencyUnavailable as e:
+        logger.warning(f"Inventory lookup rejected: {str(e)}")
+        REQUEST_COUNT.labels(app_name='catalog', method='GET', endpoint='/inventory', http_status=e.status_code).inc()
+        raise
+    except Exception as e:
+        logger.error(f"Error reading inventory for {product}: {str(e)}")
+        REQUEST_COUNT.labels(app_name='catalog', method='GET', endpoint='/inventory', http_status=500).inc()
+        return jsonify({"error": "Inventory lookup failed"}), 500
+
 def create_app():
     """Application factory function"""
     logger.info("Creating app for Gunicorn: %s", 'catalog-service')
-    global engine
-    try:
-        # Initialize database connection
-        engine = get_db_engine()
-        with get_db_connection() as conn:
-            conn.execute(text("SELECT 1"))
-        logger.info("Database connection successful")
-        
-        # Start metrics server - TODO: Using metrics server with the service's metrics endpoint!
-        # start_http_server(8003)
-        # logger.info("Metrics server started on port 8003")
-        
-        return app
-    except Exception as e:
-        logger.error(f"Failed to initialize application: {str(e)}")
-        # raise
+    # Bind immediately, the database is initialized in the background with backoff
+    initializer.start()
+    health_monitor.start()
+
+    # Start metrics server - TODO: Using metrics server with the service's metrics endpoint!
+    # start_http_server(8003)
+    # logger.info("Metrics server started on port 8003")
+
+    return app
 
 # For Gunicorn
 application = create_app()
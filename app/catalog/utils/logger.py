@@ -1,19 +1,148 @@
+import atexit
+import copy
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from prometheus_client import Counter, Gauge
+from pythonjsonlogger import jsonlogger
+
+from utils.metrics import gauge_function
 
 parent_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Records tagged with a sample_key (e.g. probe and scrape endpoints) are limited
+# to LOG_SAMPLE_LIMIT records per LOG_SAMPLE_WINDOW seconds for each key
+LOG_SAMPLE_LIMIT = int(os.getenv('LOG_SAMPLE_LIMIT', '1'))
+LOG_SAMPLE_WINDOW = float(os.getenv('LOG_SAMPLE_WINDOW', '60'))
+
+# Metrics
+LOG_RECORDS_QUEUED = Counter(
+    'log_records_queued_total', 'Log records handed to the logging queue',
+    ['app_name']
+)
+LOG_RECORDS_DROPPED = Counter(
+    'log_records_dropped_total', 'Log records dropped before reaching a handler',
+    ['app_name', 'reason']
+)
+LOG_QUEUE_DEPTH = Gauge(
+    'log_queue_depth', 'Log records waiting for the listener thread, summed over workers',
+    ['app_name'], multiprocess_mode='livesum'
+)
+
+# (queue handler, listener) pairs started by setup_logger, keyed by service name
+_pipelines = {}
+
+
+class SampleFilter(logging.Filter):
+    """
+    Rate limit records carrying a ``sample_key`` extra; other records pass through
+    """
+
+    def __init__(self, service_name, limit=LOG_SAMPLE_LIMIT, window=LOG_SAMPLE_WINDOW):
+        super().__init__()
+        self.service_name = service_name
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        key = getattr(record, 'sample_key', None)
+        if key is None:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            started, count = self._windows.get(key, (now, 0))
+            if now - started >= self.window:
+                started, count = now, 0
+            count += 1
+            self._windows[key] = (started, count)
+
+        if count > self.limit:
+            LOG_RECORDS_DROPPED.labels(app_name=self.service_name, reason='sampled').inc()
+            return False
+        return True
+
+
+# Renders tracebacks on the logging thread, see NonBlockingQueueHandler.prepare
+_exception_formatter = logging.Formatter()
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Queue handler that never blocks the calling thread; records are dropped and
+    counted when the queue is full
+    """
+
+    def __init__(self, log_queue, service_name):
+        super().__init__(log_queue)
+        self.service_name = service_name
+
+    def prepare(self, record):
+        # Render the message and traceback while the caller's arguments and exception
+        # are still as logged; JSON formatting and I/O are left to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            LOG_RECORDS_QUEUED.labels(app_name=self.service_name).inc()
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels(app_name=self.service_name, reason='queue_full').inc()
+
+
+def _stop_listeners():
+    """Flush and stop every listener thread"""
+    for _, listener in _pipelines.values():
+        listener.stop()
+    _pipelines.clear()
+
+
+def _restart_listeners_after_fork():
+    """
+    Threads do not survive fork, so a worker forked from a master that already
+    configured logging (gunicorn preload_app) gets a fresh queue and listener
+    """
+    for service_name, (queue_handler, listener) in list(_pipelines.items()):
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        queue_handler.queue = log_queue
+        gauge_function(LOG_QUEUE_DEPTH.labels(app_name=service_name), log_queue.qsize)
+        listener = QueueListener(log_queue, *listener.handlers, respect_handler_level=True)
+        listener.start()
+        _pipelines[service_name] = (queue_handler, listener)
+
+
+atexit.register(_stop_listeners)
+os.register_at_fork(after_in_child=_restart_listeners_after_fork)
+
+
 def setup_logger(service_name):
+    logger = logging.getLogger(service_name)
+    # Calling setup_logger again returns the already configured logger
+    if service_name in _pipelines:
+        return logger
+
     # Create logs directory if it doesn't exist
     log_dir = f"{parent_dir}/logs_and_metrics/{service_name}"
     os.makedirs(log_dir, exist_ok=True)
 
-    # Create logger
-    logger = logging.getLogger(service_name)
-    logger.setLevel(logging.INFO)
+    logger.setLevel(LOG_LEVEL)
 
-    # Create handlers
+    # Create handlers, these run on the listener thread only
     console_handler = logging.StreamHandler()
     file_handler = RotatingFileHandler(
         f'{log_dir}/{service_name}.log',
@@ -22,14 +151,25 @@ def setup_logger(service_name):
     )
 
     # Create formatters and add it to handlers
-    log_format = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    log_format = jsonlogger.JsonFormatter(
+        '%(asctime)s %(name)s %(levelname)s %(message)s'
     )
     console_handler.setFormatter(log_format)
     file_handler.setFormatter(log_format)
 
-    # Add handlers to the logger
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    # Request threads only enqueue records, the listener does formatting and I/O
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue, service_name)
+    queue_handler.addFilter(SampleFilter(service_name))
+    gauge_function(LOG_QUEUE_DEPTH.labels(app_name=service_name), log_queue.qsize)
+
+    listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    _pipelines[service_name] = (queue_handler, listener)
+
+    # Replace any handlers left by an earlier configuration
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
 
-    return logger
\ No newline at end of file
+    return logger
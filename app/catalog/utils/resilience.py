@@ -0,0 +1,194 @@
+import math
+import os
+import threading
+import time
+
+from flask import g, has_request_context, jsonify, request
+from prometheus_client import Counter, Gauge
+
+# Budget for a whole request; a caller may lower it with the X-Request-Timeout-Ms header
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE_SECONDS', '5'))
+DEADLINE_HEADER = 'X-Request-Timeout-Ms'
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+
+# Metrics
+CIRCUIT_STATE = Gauge(
+    'circuit_breaker_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open), the worst over workers',
+    ['app_name', 'dependency'], multiprocess_mode='livemax'
+)
+CIRCUIT_SHORT_CIRCUITS = Counter(
+    'circuit_breaker_short_circuits_total', 'Calls rejected without reaching the dependency',
+    ['app_name', 'dependency']
+)
+CIRCUIT_FAILURES = Counter(
+    'circuit_breaker_failures_total', 'Dependency calls that failed through a circuit breaker',
+    ['app_name', 'dependency']
+)
+DEADLINE_EXCEEDED = Counter(
+    'request_deadline_exceeded_total', 'Requests that ran out of deadline before a dependency call',
+    ['app_name', 'dependency']
+)
+
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+
+class DependencyUnavailable(Exception):
+    """A dependency call was not attempted; the request should fail fast"""
+
+    status_code = 503
+
+    def __init__(self, dependency, message, retry_after=None):
+        super().__init__(message)
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(DependencyUnavailable):
+    """The dependency's circuit is open"""
+
+
+class DeadlineExceeded(DependencyUnavailable):
+    """The request deadline passed before the dependency call"""
+
+    status_code = 504
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures, rejects calls for
+    ``reset_timeout`` seconds, then lets a single trial call through (half-open)
+    that closes the circuit on success or re-opens it on failure.
+
+    Use as ``breaker.call(func, *args)`` or as a context manager around the call.
+    ``is_failure`` decides which exceptions count against the dependency, e.g. to
+    ignore client errors.
+    """
+
+    def __init__(self, service_name, dependency, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout=CIRCUIT_RESET_TIMEOUT, is_failure=None):
+        self.service_name = service_name
+        self.dependency = dependency
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure or (lambda e: True)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._set_state(CLOSED)
+
+    def _set_state(self, state):
+        self._state = state
+        CIRCUIT_STATE.labels(app_name=self.service_name, dependency=self.dependency).set(state)
+
+    def check(self):
+        """Raise CircuitOpenError while the circuit is open, without taking the half-open trial"""
+        with self._lock:
+            if self._state == OPEN:
+                waited = time.monotonic() - self._opened_at
+                if waited < self.reset_timeout:
+                    self._reject(self.reset_timeout - waited)
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now"""
+        with self._lock:
+            if self._state == OPEN:
+                waited = time.monotonic() - self._opened_at
+                if waited < self.reset_timeout:
+                    self._reject(self.reset_timeout - waited)
+                self._set_state(HALF_OPEN)
+            if self._state == HALF_OPEN:
+                if self._trial_in_flight:
+                    self._reject(self.reset_timeout)
+                self._trial_in_flight = True
+
+    def _reject(self, retry_after):
+        CIRCUIT_SHORT_CIRCUITS.labels(app_name=self.service_name, dependency=self.dependency).inc()
+        raise CircuitOpenError(self.dependency, f"{self.dependency} circuit is open", retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            if self._state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        CIRCUIT_FAILURES.labels(app_name=self.service_name, dependency=self.dependency).inc()
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def call(self, func, *args, **kwargs):
+        with self:
+            return func(*args, **kwargs)
+
+    def __enter__(self):
+        self.before_call()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, DependencyUnavailable):
+            # Not attempted, so it says nothing about the dependency's health
+            with self._lock:
+                self._trial_in_flight = False
+        elif exc_type is None or not self.is_failure(exc):
+            self.record_success()
+        else:
+            self.record_failure()
+        return False
+
+
+def remaining(dependency, cap):
+    """
+    Seconds the next call to ``dependency`` may take: the time left before the request
+    deadline, capped at ``cap``. Outside a request this is just ``cap``.
+    Raises DeadlineExceeded when the deadline has already passed.
+    """
+    if not has_request_context() or 'deadline' not in g:
+        return cap
+    left = g.deadline - time.monotonic()
+    if left <= 0:
+        DEADLINE_EXCEEDED.labels(app_name=g.service_name, dependency=dependency).inc()
+        raise DeadlineExceeded(dependency, f"Request deadline exceeded before calling {dependency}")
+    g.called_dependency = True
+    return min(left, cap)
+
+
+def timed_out_in_dependency():
+    """
+    Whether a 504 means this service is too slow: the request waited on a dependency
+    and had the full REQUEST_DEADLINE, not a budget its caller cut short
+    """
+    return g.get('called_dependency', False) and not g.get('deadline_shortened', False)
+
+
+def install_resilience(app, service_name):
+    """Start a deadline for each request and turn fail-fast errors into 503/504 responses"""
+
+    @app.before_request
+    def start_deadline():
+        budget = REQUEST_DEADLINE
+        header = request.headers.get(DEADLINE_HEADER)
+        if header:
+            try:
+                budget = min(budget, int(header) / 1000)
+            except ValueError:
+                pass
+        g.service_name = service_name
+        g.deadline = time.monotonic() + budget
+        g.deadline_shortened = budget < REQUEST_DEADLINE
+
+    @app.errorhandler(DependencyUnavailable)
+    def dependency_unavailable(e):
+        headers = {}
+        if e.retry_after is not None:
+            headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+        return jsonify({"error": str(e), "dependency": e.dependency}), e.status_code, headers
+
+    return app
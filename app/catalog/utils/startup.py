@@ -0,0 +1,103 @@
+import os
+import random
+import threading
+import time
+
+INIT_BACKOFF_BASE = float(os.getenv('INIT_BACKOFF_BASE', '0.5'))
+INIT_BACKOFF_MAX = float(os.getenv('INIT_BACKOFF_MAX', '30'))
+# Set by gunicorn-config.py when the app is preloaded, so only forked workers
+# (not the master) open connections and consume messages
+INIT_AFTER_FORK = os.getenv('INIT_AFTER_FORK', 'false').lower() == 'true'
+
+
+class DependencyInitializer:
+    """
+    Initializes a service's dependencies on a background thread so the app can bind
+    and answer /livez immediately. Each step is retried with jittered exponential
+    backoff until it succeeds; the service is ready once every step has succeeded.
+    """
+
+    def __init__(self, service_name, logger):
+        self.service_name = service_name
+        self.logger = logger
+        self._steps = []
+        self._state = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        # Steps invalidated while the init thread was running, it runs them again
+        self._invalidated = set()
+        self._forked = False
+        os.register_at_fork(after_in_child=self._restart_after_fork)
+
+    def add_step(self, name, func):
+        """Register ``func`` as an init step; it signals failure by raising"""
+        self._steps.append((name, func))
+        self._state[name] = {"ready": False, "attempts": 0, "error": None}
+
+    def start(self):
+        """Start the init thread unless it is already running"""
+        if INIT_AFTER_FORK and not self._forked:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._invalidated.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=f'{self.service_name}-init', daemon=True
+            )
+            self._thread.start()
+
+    def invalidate(self, name):
+        """Mark a step as failed, e.g. when its connection dropped, and run it again"""
+        with self._lock:
+            self._state[name]["ready"] = False
+            self._invalidated.add(name)
+        self.start()
+
+    def _restart_after_fork(self):
+        # A worker forked from the gunicorn master does not inherit the init thread
+        self._lock = threading.Lock()
+        self._thread = None
+        self._invalidated = set()
+        self._forked = True
+        if self._steps and not self.ready():
+            self.start()
+
+    def _run(self):
+        started = time.monotonic()
+        while True:
+            self._run_steps()
+            with self._lock:
+                # A step may fail again before the thread exits, e.g. a consumer it started;
+                # checked under the lock so invalidate() either sees this thread gone or is seen here
+                if not self._invalidated:
+                    self._thread = None
+                    break
+                for name in self._invalidated:
+                    self._state[name]["ready"] = False
+                self._invalidated.clear()
+        self.logger.info(f"{self.service_name} dependencies ready in {time.monotonic() - started:.2f}s")
+
+    def _run_steps(self):
+        for name, func in self._steps:
+            if self._state[name]["ready"]:
+                continue
+            delay = INIT_BACKOFF_BASE
+            while True:
+                self._state[name]["attempts"] += 1
+                try:
+                    func()
+                    self._state[name].update(ready=True, error=None)
+                    self.logger.info(f"Initialized {name} after {self._state[name]['attempts']} attempt(s)")
+                    break
+                except Exception as e:
+                    self._state[name]["error"] = str(e)
+                    self.logger.warning(f"Initializing {name} failed, retrying in {delay:.1f}s: {str(e)}")
+                    time.sleep(delay * random.uniform(0.5, 1.0))
+                    delay = min(delay * 2, INIT_BACKOFF_MAX)
+
+    def ready(self):
+        return all(state["ready"] for state in self._state.values())
+
+    def status(self):
+        return {name: dict(state) for name, state in self._state.items()}
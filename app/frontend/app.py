@@ -5,17 +5,32 @@ from prometheus_client import start_http_server, Counter, Histogram
 import time
 import os
 import sys
+import threading
 
 # Add the parent directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.logger import setup_logger
+from utils.json_provider import install_json_provider
+from utils.startup import DependencyInitializer
+from utils.metrics import metrics_response
+from utils.health import HealthMonitor
+from utils.admission import install_admission
+from utils.resilience import install_resilience
+from utils.tracing import CONSUMER, extract, install_tracing
 
 # Initialize Flask app
 app = Flask(__name__)
+install_json_provider(app)
+install_admission(app, 'frontend')
+install_resilience(app, 'frontend')
 
 # Metrics
 API_HITS = Counter('api_hits', 'API Hits', ['method', 'endpoint'])
 PROCESSING_TIME = Histogram('processing_time_seconds', 'Processing Time', ['endpoint'])
+ORDER_CONSUME_LAG = Histogram(
+    'order_consume_lag_seconds', 'Time from the order service publishing an order to it being consumed',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+)
 
 # RabbitMQ configuration
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
@@ -23,20 +38,67 @@ QUEUE_NAME = "orders"
 
 # Logging setup
 logger = setup_logger('frontend')
+tracer = install_tracing(app, 'frontend', logger)
 
-def poll_rabbitmq():
+def poll_rabbitmq(connection, channel):
     """
     Poll RabbitMQ for new orders
     """
     try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
-        channel = connection.channel()
-        channel.queue_declare(queue=QUEUE_NAME)
-        for method_frame, properties, body in channel.consume(QUEUE_NAME, auto_ack=True):
-            logger.info(f"Received message: {body.decode('utf-8')}")
-            channel.basic_ack(method_frame.delivery_tag)
+        for method_frame, properties, body in channel.consume(QUEUE_NAME):
+            headers = properties.headers or {}
+            # Continue the trace of the request that published the order
+            with tracer.span(
+                'rabbitmq.consume', kind=CONSUMER, parent=extract(headers),
+                attributes={"messaging.system": "rabbitmq", "messaging.source.name": QUEUE_NAME}
+            ):
+                published_at_ms = headers.get('x-published-at-ms')
+                if published_at_ms is not None:
+                    # Clocks of different hosts may disagree slightly, never report negative lag
+                    ORDER_CONSUME_LAG.observe(max(0.0, time.time() - published_at_ms / 1000))
+                logger.info(f"Received message: {body.decode('utf-8')}")
+                channel.basic_ack(method_frame.delivery_tag)
     except Exception as e:
         logger.error(f"Error polling RabbitMQ: {e}")
+        # Drop the failed connection's socket before reconnecting in the background
+        try:
+            connection.close()
+        except Exception:
+            pass
+        initializer.invalidate('message_queue')
+
+# Thread running poll_rabbitmq, started by init_message_queue
+consumer_thread = None
+
+def init_message_queue():
+    """
+    Startup step: connect to RabbitMQ and start consuming orders on a background thread
+    """
+    global consumer_thread
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
+    channel = connection.channel()
+    # Same declaration as the order service, which publishes persistent messages
+    channel.queue_declare(queue=QUEUE_NAME, durable=True)
+    consumer_thread = threading.Thread(target=poll_rabbitmq, args=(connection, channel), daemon=True)
+    consumer_thread.start()
+
+# The order consumer is started in the background and reported by /health
+initializer = DependencyInitializer('frontend', logger)
+initializer.add_step('message_queue', init_message_queue)
+
+def check_message_queue():
+    """
+    Health check: the order consumer thread is running
+    """
+    if not initializer.ready():
+        return "initializing"
+    if consumer_thread is None or not consumer_thread.is_alive():
+        raise ConnectionError("Order consumer is not running")
+    return "connected"
+
+# Dependencies are probed in the background, /health serves the cached results
+health_monitor = HealthMonitor('frontend', logger)
+health_monitor.add_check('message_queue', check_message_queue)
 
 @app.route("/")
 def home():
@@ -51,28 +113,50 @@ def home():
         "message": "Frontend Service Running!"
     }), 200
 
+@app.route("/livez")
+def livez():
+    """
+    Liveness probe: the process is up and serving requests
+    """
+    return jsonify({"status": "alive"}), 200
+
+@app.route("/readyz")
+def readyz():
+    """
+    Readiness probe: pages are served without the broker, so the frontend is ready as
+    soon as it serves; the order consumer is reported by /health
+    """
+    return jsonify({"status": "ready"}), 200
+
 @app.route("/metrics")
 def metrics():
     """
     Metrics endpoint for the frontend service
     """
-    from prometheus_client import generate_latest
-    logger.info("Metrics request received for frontend service")
-    return generate_latest()
+    logger.info("Metrics request received for frontend service", extra={"sample_key": "/metrics"})
+    return metrics_response()
 
 @app.route("/health")
 def health():
     """
     Health check endpoint for the frontend service
     """
-    logger.info("Health check request received for frontend service")
-    return jsonify({"status": "healthy"}), 200
+    logger.info("Health check request received for frontend service", extra={"sample_key": "/health"})
+    checks = health_monitor.snapshot()
+    return jsonify({
+        "status": "healthy",
+        "message_queue": checks["message_queue"]["status"],
+        "checks": checks
+    }), 200
 
 def create_app():
     """
     Application factory function
     """
     logger.info("Creating app for Gunicorn: %s", 'frontend-service')
+    # Bind immediately, the order consumer connects in the background with backoff
+    initializer.start()
+    health_monitor.start()
     return app
 
 # For Gunicorn
@@ -82,10 +166,5 @@ if __name__ == "__main__":
     # Start Prometheus metrics server
     start_http_server(8003) # TODO: we are using metrics server with the service's metrics endpoint!
     
-    # Start RabbitMQ polling in a separate thread
-    import threading
-    rabbitmq_thread = threading.Thread(target=poll_rabbitmq, daemon=True)
-    rabbitmq_thread.start()
-    
     # Start Flask app on port 5004
     application.run(host="0.0.0.0", port=5004)
\ No newline at end of file
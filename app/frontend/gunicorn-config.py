@@ -1,10 +1,149 @@
 # Gunicorn configuration
+import glob
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+
 bind = "0.0.0.0:5004"
-workers = 1
-threads = 2
-worker_class = "sync"
-worker_connections = 1000
-timeout = 120
+
+
+def cpu_quota():
+    """
+    CPUs available to the container: the cgroup CPU quota when one is set,
+    otherwise the CPUs this process may run on. GUNICORN_CPUS overrides both.
+    """
+    if os.getenv("GUNICORN_CPUS"):
+        return float(os.getenv("GUNICORN_CPUS"))
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if quota > 0:
+                return quota / period
+        except (OSError, ValueError):
+            pass
+    return float(len(os.sched_getaffinity(0)))
+
+
+# Worker profile, selected with GUNICORN_WORKER_PROFILE:
+# - gthread: threaded workers, suits blocking drivers such as psycopg2
+# - gevent / eventlet: green threads, only cooperative for pure-Python I/O
+# - asgi: uvicorn worker running the Flask app through its WSGI interface
+# - sync: one request per worker
+worker_profile = os.getenv("GUNICORN_WORKER_PROFILE", "gthread")
+cpu_limit = cpu_quota()
+cpus = math.ceil(cpu_limit)
+
+workers = int(os.getenv("GUNICORN_WORKERS", max(1, cpus)))
+# gthread threads per CPU of quota. Threads overlap the handlers' I/O waits rather than
+# use CPU, and workers already scale with whole CPUs, so this only lowers the per-worker
+# count below it for a fractional quota
+threads_per_cpu = int(os.getenv("GUNICORN_THREADS_PER_CPU", "4"))
+threads = 1
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+if worker_profile == "gthread":
+    from gunicorn.workers.gthread import ThreadWorker
+
+    class QueueTimedThreadWorker(ThreadWorker):
+        """
+        gthread worker that records when each request was queued for a thread, as
+        environ["gunicorn.enqueued_at"] (time.monotonic), so admission can reject
+        requests that queued too long
+        """
+
+        request_local = threading.local()
+
+        def enqueue_req(self, conn):
+            conn.enqueued_at = time.monotonic()
+            super().enqueue_req(conn)
+
+        def handle(self, conn):
+            self.request_local.enqueued_at = conn.enqueued_at
+            return super().handle(conn)
+
+        def load_wsgi(self):
+            super().load_wsgi()
+            application, request_local = self.wsgi, self.request_local
+
+            def wsgi(environ, start_response):
+                environ["gunicorn.enqueued_at"] = request_local.enqueued_at
+                return application(environ, start_response)
+
+            self.wsgi = wsgi
+
+    worker_class = QueueTimedThreadWorker
+    threads = int(os.getenv("GUNICORN_THREADS", max(2, round(threads_per_cpu * cpu_limit / workers))))
+elif worker_profile in ("gevent", "eventlet"):
+    worker_class = worker_profile
+elif worker_profile == "asgi":
+    from uvicorn.workers import UvicornWorker
+
+    class WSGIUvicornWorker(UvicornWorker):
+        CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "interface": "wsgi"}
+
+    worker_class = WSGIUvicornWorker
+else:
+    worker_class = "sync"
+
+# Import the app once in the master so workers share code and warm state copy-on-write.
+# Green-thread workers must monkey-patch before the app is imported, so they load per worker.
+preload_app = os.getenv(
+    "GUNICORN_PRELOAD", "false" if worker_profile in ("gevent", "eventlet") else "true"
+).lower() == "true"
+# Dependencies are then initialized in each worker after fork, not in the master
+os.environ["INIT_AFTER_FORK"] = "true" if preload_app else "false"
+# Requests a threaded or sync worker handles at once, the ceiling of its admission limit
+if worker_profile == "gthread" or worker_class == "sync":
+    os.environ["WORKER_CONCURRENCY"] = str(threads)
+
+# Recycle workers to bound leaks; jitter keeps them from restarting together. A lone worker
+# is not recycled by default: each restart leaves the pod without a worker and resets its
+# circuit breakers, admission limit, health cache and metrics
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000" if workers > 1 else "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+# Each worker keeps its own metrics, so with several of them /metrics would only show the
+# worker that served the scrape. They write them to PROMETHEUS_MULTIPROC_DIR instead,
+# which /metrics aggregates (prometheus_client multiprocess mode)
+created_multiproc_dir = None
+if workers > 1 or os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if not multiproc_dir:
+        multiproc_dir = created_multiproc_dir = tempfile.mkdtemp(prefix="prometheus-")
+    os.makedirs(multiproc_dir, exist_ok=True)
+    # Files left by an earlier run would add its counts to this one
+    for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+        os.remove(path)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = multiproc_dir
+
+
+def child_exit(server, worker):
+    """Drop the live gauges of a worker that exited"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    """Remove the metrics directory created for this run"""
+    if created_multiproc_dir:
+        shutil.rmtree(created_multiproc_dir, ignore_errors=True)
+
+
 keepalive = 5
 
 # Logging
@@ -19,4 +158,4 @@ graceful_timeout = 300
 
 # Health check settings
 health_check_interval = 30
-health_check_timeout = 10
\ No newline at end of file
+health_check_timeout = 10
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+
+from prometheus_client import Gauge, Histogram
+
+from utils.metrics import gauge_function
+from utils.startup import INIT_AFTER_FORK
+
+HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', '10'))
+HEALTH_CHECK_TIMEOUT = float(os.getenv('HEALTH_CHECK_TIMEOUT', '2'))
+
+# Metrics
+HEALTH_CHECK_LATENCY = Histogram(
+    'health_check_latency_seconds', 'Dependency health check latency',
+    ['app_name', 'dependency']
+)
+HEALTH_CHECK_UP = Gauge(
+    'health_check_up', 'Whether the last dependency health check passed (in every worker)',
+    ['app_name', 'dependency'], multiprocess_mode='livemin'
+)
+HEALTH_CHECK_AGE = Gauge(
+    'health_check_age_seconds', 'Seconds since the dependency was last checked (by any worker, the oldest)',
+    ['app_name', 'dependency'], multiprocess_mode='livemax'
+)
+
+
+class HealthMonitor:
+    """
+    Probes each dependency on a background thread every ``interval`` seconds so
+    /health serves the latest cached result instead of opening connections per call
+    """
+
+    def __init__(self, service_name, logger, interval=HEALTH_CHECK_INTERVAL):
+        self.service_name = service_name
+        self.logger = logger
+        self.interval = interval
+        self._checks = []
+        self._results = {}
+        self._thread = None
+        self._forked = False
+        os.register_at_fork(after_in_child=self._restart_after_fork)
+
+    def add_check(self, name, func, healthy_status='connected', failure_status='disconnected'):
+        """
+        Register ``func`` as a check; it returns the dependency's status string and a
+        raised exception is reported as ``failure_status``
+        """
+        self._checks.append((name, func, healthy_status, failure_status))
+        self._results[name] = {"status": "unknown", "latency_ms": None, "checked_at": None, "error": None}
+        gauge_function(
+            HEALTH_CHECK_AGE.labels(app_name=self.service_name, dependency=name), lambda: self._age(name) or 0
+        )
+
+    def start(self):
+        """Start the probe thread unless it is already running"""
+        if INIT_AFTER_FORK and not self._forked:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._run, name=f'{self.service_name}-health', daemon=True
+        )
+        self._thread.start()
+
+    def _restart_after_fork(self):
+        # A worker forked from the gunicorn master does not inherit the probe thread
+        self._thread = None
+        self._forked = True
+        if self._checks:
+            self.start()
+
+    def _run(self):
+        while True:
+            self.check_all()
+            time.sleep(self.interval)
+
+    def check_all(self):
+        """Run every check once and update the cached results"""
+        for name, func, healthy_status, failure_status in self._checks:
+            started = time.monotonic()
+            error = None
+            try:
+                status = func()
+            except Exception as e:
+                status = failure_status
+                error = str(e)
+            latency = time.monotonic() - started
+
+            HEALTH_CHECK_LATENCY.labels(app_name=self.service_name, dependency=name).observe(latency)
+            HEALTH_CHECK_UP.labels(app_name=self.service_name, dependency=name).set(
+                1 if status == healthy_status else 0
+            )
+            previous = self._results[name]["status"]
+            if status != previous and previous != "unknown":
+                self.logger.warning(f"Dependency {name} changed from {previous} to {status}")
+            # Replace rather than mutate so readers never see a half-written result
+            self._results[name] = {
+                "status": status,
+                "latency_ms": round(latency * 1000, 2),
+                "checked_at": time.time(),
+                "error": error,
+            }
+
+    def _age(self, name):
+        checked_at = self._results[name]["checked_at"]
+        return None if checked_at is None else round(time.time() - checked_at, 2)
+
+    def status(self, name):
+        return self._results[name]["status"]
+
+    def snapshot(self):
+        """Cached results with their age in seconds, for the /health response"""
+        return {
+            name: {
+                "status": result["status"],
+                "latency_ms": result["latency_ms"],
+                "age_seconds": self._age(name),
+                "error": result["error"],
+            }
+            for name, result in self._results.items()
+        }
@@ -1,7 +1,8 @@
 from flask import Flask, jsonify, request
 import pika
 import psycopg2
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Counter, Histogram
+import math
 import os
 import time
 import sys
@@ -12,11 +13,24 @@ import json
 # Add the project root to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.logger import setup_logger
+from utils.json_provider import install_json_provider
+from utils.startup import DependencyInitializer
+from utils.metrics import metrics_response
+from utils.health import HEALTH_CHECK_TIMEOUT, HealthMonitor
+from utils.admission import install_admission
+from utils.resilience import CircuitBreaker, DependencyUnavailable, install_resilience, remaining
+from utils import inventory
+from utils.tracing import CLIENT, PRODUCER, inject, install_tracing
 
 app = Flask(__name__)
+install_json_provider(app)
+# Writes touch Postgres and RabbitMQ, so they are shed before cheap reads
+install_admission(app, 'order', low_priority=('/order',))
+install_resilience(app, 'order')
 
 # Initialize logger
 logger = setup_logger('order')
+tracer = install_tracing(app, 'order', logger)
 
 # Metrics
 REQUEST_COUNT = Counter(
@@ -28,14 +42,15 @@ REQUEST_LATENCY = Histogram(
     ['app_name', 'endpoint']
 )
 
-# Database connection
-def get_db_connection():
+# Database connection, extra keyword arguments are passed to psycopg2.connect
+def get_db_connection(**kwargs):
     return psycopg2.connect(
         host=os.getenv('POSTGRES_HOST'),
         port=os.getenv('POSTGRES_PORT', '5432'),
         database=os.getenv('POSTGRES_DB'),
         user=os.getenv('POSTGRES_USER'),
-        password=os.getenv('POSTGRES_PASSWORD')
+        password=os.getenv('POSTGRES_PASSWORD'),
+        **kwargs
     )
 
 # RabbitMQ connection parameters
@@ -43,6 +58,23 @@ RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'rabbitmq')
 RABBITMQ_USER = os.getenv('RABBITMQ_USERNAME', 'guest')
 RABBITMQ_PASS = os.getenv('RABBITMQ_PASSWORD', 'guest')
 
+# Upper bounds for a single dependency call, requests are further limited by their deadline
+DB_TIMEOUT = float(os.getenv('DB_TIMEOUT', '2'))
+RABBITMQ_TIMEOUT = float(os.getenv('RABBITMQ_TIMEOUT', '2'))
+# Attempts to confirm a published order's stock, or cancel an order that was not published
+ORDER_FINISH_ATTEMPTS = int(os.getenv('ORDER_FINISH_ATTEMPTS', '3'))
+
+# Span attributes
+DB_SPAN = {"db.system": "postgresql"}
+QUEUE_SPAN = {"messaging.system": "rabbitmq", "messaging.destination.name": "orders"}
+
+# Running out of stock or an unknown product is an answer from a healthy database, not a failure
+db_breaker = CircuitBreaker(
+    'order', 'database',
+    is_failure=lambda e: not isinstance(e, (inventory.OutOfStock, inventory.UnknownProduct))
+)
+mq_breaker = CircuitBreaker('order', 'message_queue')
+
 def init_db():
     """Initialize the database with required tables"""
     try:
@@ -57,6 +89,9 @@ def init_db():
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 );
             """)
+            # Orders are looked up by order_id when they are confirmed or cancelled
+            cursor.execute("CREATE INDEX IF NOT EXISTS orders_order_id ON orders (order_id)")
+            cursor.execute(inventory.RESERVATIONS_TABLE)
         conn.commit()
         conn.close()
         logger.info("Database initialized successfully")
@@ -64,31 +99,189 @@ def init_db():
         logger.error(f"Error initializing database: {str(e)}")
         raise
 
-def publish_to_queue(message):
-    """Publish message to RabbitMQ"""
+def init_message_queue():
+    """Startup step: connect to RabbitMQ once and declare the orders queue"""
+    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+    connection = pika.BlockingConnection(
+        pika.ConnectionParameters(
+            host=RABBITMQ_HOST,
+            credentials=credentials,
+            connection_attempts=1,
+            socket_timeout=5
+        )
+    )
+    connection.channel().queue_declare(queue='orders', durable=True)
+    connection.close()
+    logger.info("Message queue initialized successfully")
+
+def check_inventory():
+    """Startup step: the catalog service has created the stock table"""
+    conn = get_db_connection()
     try:
-        credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters(
-                host=RABBITMQ_HOST,
-                credentials=credentials,
-                connection_attempts=3,
-                retry_delay=5
-            )
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM inventory_shards LIMIT 1")
+    finally:
+        conn.close()
+
+# Dependencies are initialized in the background, see /readyz
+initializer = DependencyInitializer('order', logger)
+initializer.add_step('database', init_db)
+initializer.add_step('inventory', check_inventory)
+initializer.add_step('message_queue', init_message_queue)
+
+def check_database():
+    """Health check: connect and run a test query"""
+    conn = get_db_connection(
+        connect_timeout=max(1, int(HEALTH_CHECK_TIMEOUT)),
+        options=f'-c statement_timeout={int(HEALTH_CHECK_TIMEOUT * 1000)}'
+    )
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    finally:
+        conn.close()
+    return "connected"
+
+def check_message_queue():
+    """Health check: open and close a RabbitMQ connection"""
+    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+    connection = pika.BlockingConnection(
+        pika.ConnectionParameters(
+            host=RABBITMQ_HOST,
+            credentials=credentials,
+            connection_attempts=1,
+            socket_timeout=HEALTH_CHECK_TIMEOUT,
+            # Bounds the whole AMQP handshake, not just each socket operation
+            stack_timeout=HEALTH_CHECK_TIMEOUT,
+            blocked_connection_timeout=HEALTH_CHECK_TIMEOUT
         )
-        channel = connection.channel()
-        channel.queue_declare(queue='orders', durable=True)
-        channel.basic_publish(
-            exchange='',
-            routing_key='orders',
-            body=message,
-            properties=pika.BasicProperties(delivery_mode=2)
+    )
+    connection.close()
+    return "connected"
+
+# Dependencies are probed in the background, /health serves the cached results
+health_monitor = HealthMonitor('order', logger)
+health_monitor.add_check('database', check_database)
+health_monitor.add_check('message_queue', check_message_queue)
+
+# Holds of orders that never got confirmed (e.g. the worker died) go back to stock
+reservation_sweeper = inventory.ReservationSweeper('order', logger, get_db_connection)
+
+def open_order_connection():
+    """Connect for one order, bounded by the request deadline and the database circuit breaker"""
+    timeout = remaining('database', DB_TIMEOUT)
+    with tracer.span('postgres.connect', kind=CLIENT, attributes=DB_SPAN), db_breaker:
+        return get_db_connection(
+            connect_timeout=max(1, math.ceil(timeout)),
+            options=f'-c statement_timeout={int(timeout * 1000)}'
         )
-        logger.info(f"Published message to orders queue: {message}")
-        connection.close()
+
+def run_transaction(conn, func, *args):
+    """Run func(cursor, *args) as one transaction"""
+    try:
+        with conn.cursor() as cursor:
+            result = func(cursor, *args)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+
+def in_transaction(conn, func, *args):
+    """Run func(cursor, *args) as one transaction behind the database circuit breaker"""
+    with db_breaker:
+        return run_transaction(conn, func, *args)
+
+def store_order(cursor, order_id, product, quantity):
+    """Reserve stock and insert the order; both happen or neither does. Returns the holds"""
+    holds = inventory.reserve(cursor, 'order', order_id, product, quantity)
+    cursor.execute(
+        "INSERT INTO orders (order_id, product, quantity) VALUES (%s, %s, %s)",
+        (order_id, product, quantity)
+    )
+    return holds
+
+def retry_transaction(conn, name, order_id, func, *args):
+    """
+    Run func(cursor, *args) for an order whose fate is already decided, so it must not
+    be lost: retried on a new connection and past the circuit breaker. Raises the last
+    error if every attempt fails
+    """
+    for attempt in range(ORDER_FINISH_ATTEMPTS):
+        try:
+            with tracer.span(f'postgres.{name}', kind=CLIENT, attributes=DB_SPAN):
+                if attempt == 0:
+                    return run_transaction(conn, func, *args)
+                time.sleep(0.1 * 2 ** attempt)
+                retry_conn = get_db_connection(connect_timeout=max(1, math.ceil(DB_TIMEOUT)))
+                try:
+                    return run_transaction(retry_conn, func, *args)
+                finally:
+                    retry_conn.close()
+        except Exception as e:
+            logger.warning(f"{name} failed for order {order_id} (attempt {attempt + 1}): {str(e)}")
+            if attempt == ORDER_FINISH_ATTEMPTS - 1:
+                raise
+
+def confirm_reservation(conn, order_id, holds):
+    """
+    The order is published: keep its stock for good. Until then its holds expire, so
+    the stock of an order that never got out (e.g. the worker died) goes back
+    """
+    try:
+        confirmed = retry_transaction(conn, 'confirm_reservation', order_id, inventory.confirm, order_id, holds)
+    except Exception:
+        logger.error(f"Order {order_id} was published but its reservation could not be confirmed")
+        return
+    if not confirmed:
+        logger.error(f"Order {order_id} was published after its reservation expired")
+
+def cancel_order(conn, order_id):
+    """Publishing failed: drop the order and return its stock in one transaction"""
+    try:
+        retry_transaction(conn, 'cancel_order', order_id, inventory.release, order_id)
+    except Exception:
+        logger.error(f"Order {order_id} was not published and could not be cancelled, its hold will expire")
+
+def publish_to_queue(message):
+    """Publish message to RabbitMQ, bounded by the request deadline and the queue circuit breaker"""
+    try:
+        timeout = remaining('message_queue', RABBITMQ_TIMEOUT)
+        with tracer.span('rabbitmq.publish', kind=PRODUCER, attributes=QUEUE_SPAN), mq_breaker:
+            credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+            connection = pika.BlockingConnection(
+                pika.ConnectionParameters(
+                    host=RABBITMQ_HOST,
+                    credentials=credentials,
+                    connection_attempts=1,
+                    socket_timeout=timeout,
+                    stack_timeout=timeout,
+                    blocked_connection_timeout=timeout
+                )
+            )
+            channel = connection.channel()
+            channel.queue_declare(queue='orders', durable=True)
+            # basic_publish then waits for the broker's ack, the order's stock is confirmed after it
+            channel.confirm_delivery()
+            channel.basic_publish(
+                exchange='',
+                routing_key='orders',
+                body=message,
+                # The consumer continues this trace and measures the lag from publish time
+                properties=pika.BasicProperties(
+                    delivery_mode=2,
+                    headers=inject({'x-published-at-ms': int(time.time() * 1000)})
+                )
+            )
+            logger.info(f"Published message to orders queue: {message}")
     except Exception as e:
         logger.error(f"Error publishing to RabbitMQ: {str(e)}")
         raise
+    # The message is out, so failing to close must not fail (and cancel) the order
+    try:
+        connection.close()
+    except Exception as e:
+        logger.warning(f"Error closing RabbitMQ connection: {str(e)}")
 
 @app.route('/')
 def home():
@@ -108,88 +301,100 @@ def create_order():
         if not data or not all(k in data for k in ["product", "quantity"]):
             REQUEST_COUNT.labels(app_name='order', method='POST', endpoint='/order', http_status=400).inc()
             return jsonify({"error": "Missing required fields"}), 400
+        quantity = data['quantity']
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+            REQUEST_COUNT.labels(app_name='order', method='POST', endpoint='/order', http_status=400).inc()
+            return jsonify({"error": "Quantity must be a positive integer"}), 400
+
+        # Fail fast before storing anything if either dependency is known to be down
+        db_breaker.check()
+        mq_breaker.check()
 
         order_id = str(uuid.uuid4())
-        
-        # Store in database
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "INSERT INTO orders (order_id, product, quantity) VALUES (%s, %s, %s)",
-                (order_id, data['product'], data['quantity'])
-            )
-        conn.commit()
-        conn.close()
-        
-        # Publish to RabbitMQ
-        message = json.dumps({
-            'order_id': order_id,
-            'product': data['product'],
-            'quantity': data['quantity'],
-            'timestamp': datetime.now().isoformat()
-        })
-        publish_to_queue(message)
+        conn = open_order_connection()
+        try:
+            # Reserve stock and store in database
+            with tracer.span('postgres.store_order', kind=CLIENT, attributes={**DB_SPAN, "order.id": order_id}):
+                holds = in_transaction(conn, store_order, order_id, data['product'], quantity)
+
+            # Publish to RabbitMQ
+            message = json.dumps({
+                'order_id': order_id,
+                'product': data['product'],
+                'quantity': quantity,
+                'timestamp': datetime.now().isoformat()
+            })
+            try:
+                publish_to_queue(message)
+            except Exception:
+                cancel_order(conn, order_id)
+                raise
+            confirm_reservation(conn, order_id, holds)
+        finally:
+            conn.close()
         
         REQUEST_LATENCY.labels(app_name='order', endpoint='/order').observe(time.time() - start_time)
         REQUEST_COUNT.labels(app_name='order', method='POST', endpoint='/order', http_status=201).inc()
         return jsonify({"order_id": order_id, "status": "created"}), 201
         
+    except inventory.OutOfStock as e:
+        logger.info(f"Rejecting order: {str(e)}")
+        REQUEST_COUNT.labels(app_name='order', method='POST', endpoint='/order', http_status=409).inc()
+        return jsonify({
+            "error": "Insufficient stock",
+            "product": e.product,
+            "requested": e.requested,
+            "available": e.available
+        }), 409
+    except inventory.UnknownProduct as e:
+        logger.info(f"Rejecting order: {str(e)}")
+        REQUEST_COUNT.labels(app_name='order', method='POST', endpoint='/order', http_status=404).inc()
+        return jsonify({"error": "Unknown product", "product": e.product}), 404
+    except DependencyUnavailable as e:
+        logger.warning(f"Rejecting order: {str(e)}")
+        REQUEST_COUNT.labels(app_name='order', method='POST', endpoint='/order', http_status=e.status_code).inc()
+        raise
     except Exception as e:
         logger.error(f"Error creating order: {str(e)}")
         REQUEST_COUNT.labels(app_name='order', method='POST', endpoint='/order', http_status=500).inc()
         return jsonify({"error": "Failed to create order"}), 500
 
+@app.route('/livez')
+def livez():
+    """Liveness probe: the process is up and serving requests"""
+    return jsonify({"status": "alive"}), 200
+
+@app.route('/readyz')
+def readyz():
+    """Readiness probe: every dependency has been initialized"""
+    if initializer.ready():
+        return jsonify({"status": "ready"}), 200
+    return jsonify({"status": "initializing", "dependencies": initializer.status()}), 503
+
 @app.route('/metrics')
 def metrics():
     """
     Metrics endpoint for Prometheus
     """
-    logger.info("Metrics endpoint called - order service")
+    logger.info("Metrics endpoint called - order service", extra={"sample_key": "/metrics"})
     # Prometheus metrics collection
-    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+    return metrics_response()
 
 @app.route('/health')
 def health():
     """
-    Health check endpoint
+    Health check endpoint, serves the latest cached dependency checks
     """
-    logger.info("Health check endpoint called - order service")
+    logger.info("Health check endpoint called - order service", extra={"sample_key": "/health"})
     try:
-        # Basic application health
+        checks = health_monitor.snapshot()
         health_status = {
             "status": "healthy",
-            "database": "unknown",
-            "message_queue": "unknown"
+            "database": checks["database"]["status"],
+            "message_queue": checks["message_queue"]["status"],
+            "checks": checks
         }
 
-        # Test database connection
-        try:
-            conn = get_db_connection()
-            with conn.cursor() as cursor:
-                cursor.execute('SELECT 1')
-            conn.close()
-            health_status["database"] = "connected"
-        except Exception as e:
-            logger.warning(f"Database health check failed: {str(e)}")
-            health_status["database"] = "disconnected"
-
-        # Test RabbitMQ connection
-        try:
-            credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-            connection = pika.BlockingConnection(
-                pika.ConnectionParameters(
-                    host=RABBITMQ_HOST,
-                    credentials=credentials,
-                    connection_attempts=1,
-                    socket_timeout=1
-                )
-            )
-            connection.close()
-            health_status["message_queue"] = "connected"
-        except Exception as e:
-            logger.warning(f"RabbitMQ health check failed: {str(e)}")
-            health_status["message_queue"] = "disconnected"
-
         # Return 200 if at least basic app is healthy
         return jsonify(health_status), 200
 
@@ -205,15 +410,16 @@ def create_app():
     Application factory function
     """
     logger.info("Creating app for Gunicorn: %s", 'order-service')
+    # Bind immediately, schema and queue are initialized in the background with backoff
+    initializer.start()
+    health_monitor.start()
+    reservation_sweeper.start()
     return app
 
 # For Gunicorn
 application = create_app()
 
 if __name__ == "__main__":
-    # Initialize database
-    init_db()
-    
     # Start metrics server - TODO: we are using metrics server with the service's metrics endpoint!
     # start_http_server(8003)
     
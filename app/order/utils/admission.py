@@ -0,0 +1,247 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, jsonify, request
+from prometheus_client import Counter, Gauge
+
+from utils.metrics import gauge_function
+from utils.resilience import timed_out_in_dependency
+
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+# Requests a worker can handle at once (its gunicorn threads), set by gunicorn-config.py.
+# Concurrency limits are per worker process and never exceed it, since a gthread worker
+# never has more requests in flight than threads
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '0'))
+ADMISSION_MAX_LIMIT = int(os.getenv('ADMISSION_MAX_LIMIT', str(WORKER_CONCURRENCY or 200)))
+ADMISSION_INITIAL_LIMIT = int(os.getenv('ADMISSION_INITIAL_LIMIT', '20'))
+ADMISSION_MIN_LIMIT = int(os.getenv('ADMISSION_MIN_LIMIT', '2'))
+# Requests that waited longer than this for a worker thread are rejected unhandled: their
+# caller is likely to have given up, and serving them only delays the requests behind
+ADMISSION_MAX_QUEUE_WAIT_MS = float(os.getenv('ADMISSION_MAX_QUEUE_WAIT_MS', '500'))
+# Latency may grow to this multiple of the long-term average before the limit shrinks
+ADMISSION_LATENCY_TOLERANCE = float(os.getenv('ADMISSION_LATENCY_TOLERANCE', '2'))
+# Share of the limit that low priority (expensive) requests may use
+ADMISSION_LOW_PRIORITY_SHARE = float(os.getenv('ADMISSION_LOW_PRIORITY_SHARE', '0.75'))
+# Per-client token bucket, per worker process; 0 disables rate limiting
+RATE_LIMIT_RPS = float(os.getenv('RATE_LIMIT_RPS', '100'))
+RATE_LIMIT_BURST = float(os.getenv('RATE_LIMIT_BURST', '200'))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv('RATE_LIMIT_MAX_CLIENTS', '10000'))
+# Proxies in front of the service that append the address they saw to X-Forwarded-For
+# (1 for the ingress gateway); 0 identifies clients by the peer address. When set, requests
+# with fewer forwarded hops come from inside the mesh and are not rate limited
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '0'))
+
+# Probes and scrapes bypass admission so overload never hides a live process
+CRITICAL_PATHS = frozenset(('/health', '/metrics', '/livez', '/readyz'))
+NORMAL, LOW = 'normal', 'low'
+
+# Metrics
+ADMISSION_LIMIT = Gauge(
+    'admission_concurrency_limit', 'Adaptive concurrency limit, summed over workers',
+    ['app_name'], multiprocess_mode='livesum'
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    'admission_in_flight', 'Admitted requests in flight, summed over workers',
+    ['app_name'], multiprocess_mode='livesum'
+)
+ADMISSION_REJECTED = Counter(
+    'admission_rejected_total', 'Requests rejected before being handled',
+    ['app_name', 'reason', 'priority']
+)
+
+
+class RequestRejected(Exception):
+    """The request was not admitted"""
+
+    def __init__(self, status_code, message, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """
+    Gradient concurrency limit: shrinks when request latency rises above
+    ``tolerance`` times its long-term average and grows by about sqrt(limit)
+    while latency holds and the limit is actually in use.
+    """
+
+    def __init__(self, service_name, initial=ADMISSION_INITIAL_LIMIT, min_limit=ADMISSION_MIN_LIMIT,
+                 max_limit=ADMISSION_MAX_LIMIT, tolerance=ADMISSION_LATENCY_TOLERANCE):
+        self.service_name = service_name
+        self.min_limit = min(min_limit, max_limit)
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self._lock = threading.Lock()
+        self._limit = float(max(self.min_limit, min(initial, max_limit)))
+        self._in_flight = 0
+        self._short_latency = None
+        self._long_latency = None
+        gauge_function(ADMISSION_LIMIT.labels(app_name=service_name), lambda: self.limit)
+        gauge_function(ADMISSION_IN_FLIGHT.labels(app_name=service_name), lambda: self._in_flight)
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def try_acquire(self, share=1.0):
+        """Take a slot if fewer than ``share`` of the limit are in flight"""
+        with self._lock:
+            if self._in_flight >= max(1, int(self._limit * share)):
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self, latency=None, dropped=False):
+        """
+        Free a slot and update the limit from the request's latency. A dropped
+        request (out of deadline while waiting on a dependency) cuts the limit by 10%;
+        ``latency=None`` only frees the slot.
+        """
+        with self._lock:
+            in_flight = self._in_flight
+            self._in_flight -= 1
+            if dropped:
+                self._set_limit(self._limit * 0.9)
+            elif latency is not None:
+                self._update(latency, in_flight)
+
+    def _update(self, latency, in_flight):
+        if self._long_latency is None:
+            self._short_latency = self._long_latency = latency
+            return
+        self._short_latency += 0.1 * (latency - self._short_latency)
+        self._long_latency += 0.01 * (latency - self._long_latency)
+        # Let the baseline recover after a sustained slowdown instead of pinning the limit low
+        if self._long_latency > 2 * self._short_latency:
+            self._long_latency *= 0.95
+        gradient = max(0.5, min(1.0, self.tolerance * self._long_latency / self._short_latency))
+        target = self._limit * gradient
+        # Probe for more capacity only while latency holds, or the limit never shrinks
+        # below the point where the growth makes up for the cut
+        if gradient >= 1.0:
+            target += math.sqrt(self._limit)
+        # Don't grow a limit the traffic isn't using
+        if in_flight < self._limit / 2:
+            target = min(target, self._limit)
+        self._set_limit(0.8 * self._limit + 0.2 * target)
+
+    def _set_limit(self, limit):
+        self._limit = max(self.min_limit, min(self.max_limit, limit))
+
+
+class RateLimiter:
+    """Token bucket per client, evicting the least recently seen client past ``max_clients``"""
+
+    def __init__(self, rate=RATE_LIMIT_RPS, burst=RATE_LIMIT_BURST, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def acquire(self, client):
+        """Take a token for ``client``; returns 0 or the seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+def client_id():
+    """
+    The address the outermost trusted proxy saw, RATE_LIMIT_TRUSTED_PROXIES entries from
+    the right of X-Forwarded-For; entries further left are set by the client. None for a
+    request the trusted proxies did not forward, whose peer is the mesh sidecar and so
+    the same for every internal caller. Without trusted proxies, the peer address.
+    """
+    if RATE_LIMIT_TRUSTED_PROXIES > 0:
+        hops = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',')]
+        hops = [hop for hop in hops if hop]
+        if len(hops) >= RATE_LIMIT_TRUSTED_PROXIES:
+            return hops[-RATE_LIMIT_TRUSTED_PROXIES]
+        return None
+    return request.remote_addr or 'unknown'
+
+
+def queue_wait():
+    """Seconds the request waited for a worker thread, None when the worker doesn't record it"""
+    enqueued_at = request.environ.get('gunicorn.enqueued_at')
+    if enqueued_at is None:
+        return None
+    return time.monotonic() - enqueued_at
+
+
+def install_admission(app, service_name, low_priority=()):
+    """
+    Rate limit each client and cap in-flight requests with an adaptive limit,
+    rejecting excess requests with 429/503 before they reach the view, as well as
+    requests that queued too long for a worker thread. Paths in ``low_priority``
+    are shed first.
+    """
+    if not ADMISSION_ENABLED:
+        return app
+    limiter = AdaptiveLimiter(service_name)
+    rate_limiter = RateLimiter() if RATE_LIMIT_RPS > 0 else None
+    low_priority = frozenset(low_priority)
+
+    def reject(status_code, reason, priority, message, retry_after):
+        ADMISSION_REJECTED.labels(app_name=service_name, reason=reason, priority=priority).inc()
+        raise RequestRejected(status_code, message, retry_after)
+
+    @app.before_request
+    def admit():
+        if request.path in CRITICAL_PATHS:
+            return
+        priority = LOW if request.path in low_priority else NORMAL
+        waited = queue_wait()
+        if waited is not None and waited * 1000 > ADMISSION_MAX_QUEUE_WAIT_MS:
+            reject(503, 'queue_timeout', priority, f"{service_name} is overloaded", 1)
+        client = client_id() if rate_limiter is not None else None
+        if client is not None:
+            wait = rate_limiter.acquire(client)
+            if wait:
+                reject(429, 'rate_limited', priority, "Rate limit exceeded", wait)
+        share = ADMISSION_LOW_PRIORITY_SHARE if priority == LOW else 1.0
+        if not limiter.try_acquire(share):
+            reject(503, 'overloaded', priority, f"{service_name} is overloaded", 1)
+        g.admitted_at = time.monotonic()
+
+    @app.after_request
+    def record_status(response):
+        g.response_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def release(exc):
+        admitted_at = g.pop('admitted_at', None)
+        if admitted_at is None:
+            return
+        status = g.pop('response_status', 500)
+        if status == 504 and timed_out_in_dependency():
+            limiter.release(dropped=True)
+        elif exc is None and status < 500:
+            limiter.release(time.monotonic() - admitted_at)
+        else:
+            # Errors, fail-fast 503s and 504s of budgets the caller cut short say little
+            # about this service's own latency
+            limiter.release()
+
+    @app.errorhandler(RequestRejected)
+    def request_rejected(e):
+        headers = {'Retry-After': str(max(1, math.ceil(e.retry_after)))}
+        return jsonify({"error": str(e)}), e.status_code, headers
+
+    return app
@@ -0,0 +1,324 @@
+import os
+import threading
+import time
+from collections import defaultdict
+
+from prometheus_client import Counter, Histogram
+
+from utils.startup import INIT_AFTER_FORK
+
+# Held stock returns to the shelf if its order is not published and confirmed within this
+# many seconds; far above the request deadline, which bounds the publish
+RESERVATION_TTL = int(os.getenv('RESERVATION_TTL_SECONDS', '300'))
+RESERVATION_SWEEP_INTERVAL = float(os.getenv('RESERVATION_SWEEP_INTERVAL', '30'))
+RESERVATION_SWEEP_BATCH = int(os.getenv('RESERVATION_SWEEP_BATCH', '500'))
+
+# Metrics
+RESERVATIONS = Counter(
+    'inventory_reservations_total', 'Stock reservation attempts by outcome',
+    ['app_name', 'outcome']
+)
+RESERVATION_LATENCY = Histogram(
+    'inventory_reservation_latency_seconds', 'Time to reserve stock, by the path that served it',
+    ['app_name', 'path']
+)
+RESERVATIONS_EXPIRED = Counter(
+    'inventory_reservations_expired_total', 'Held reservations returned to stock by the sweeper',
+    ['app_name']
+)
+
+RESERVATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS inventory_reservations (
+        order_id VARCHAR(255) NOT NULL,
+        shard INTEGER NOT NULL,
+        product VARCHAR(255) NOT NULL,
+        quantity INTEGER NOT NULL,
+        status VARCHAR(16) NOT NULL DEFAULT 'held',
+        expires_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (order_id, shard)
+    );
+    CREATE INDEX IF NOT EXISTS inventory_reservations_held
+        ON inventory_reservations (expires_at) WHERE status = 'held';
+"""
+
+# A product's stock is split over shard rows (created by the catalog service) so
+# concurrent orders for one product lock different rows instead of queueing on one.
+# Take the whole quantity from one shard that has it, skipping shards other orders hold.
+# A shard whose stock ran out since the statement started stays locked without being
+# taken, so the savepoint lets the slower paths drop such locks before they wait
+RESERVE_FROM_FREE_SHARD = """
+    SAVEPOINT reserve;
+    UPDATE inventory_shards AS s
+    SET available = s.available - %(quantity)s
+    FROM (
+        SELECT shard FROM inventory_shards
+        WHERE product = %(product)s AND available >= %(quantity)s
+        ORDER BY random()
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    ) AS target
+    WHERE s.product = %(product)s AND s.shard = target.shard
+    RETURNING s.shard
+"""
+
+# Every shard with enough stock was locked: wait on just one of them
+RESERVE_FROM_ONE_SHARD = """
+    ROLLBACK TO SAVEPOINT reserve;
+    UPDATE inventory_shards
+    SET available = available - %(quantity)s
+    WHERE product = %(product)s AND available >= %(quantity)s AND shard = (
+        SELECT shard FROM inventory_shards
+        WHERE product = %(product)s AND available >= %(quantity)s
+        ORDER BY random()
+        LIMIT 1
+    )
+    RETURNING shard
+"""
+
+# No single shard has enough: lock them all in shard order (so this cannot deadlock)
+LOCK_SHARDS = """
+    ROLLBACK TO SAVEPOINT reserve;
+    SELECT shard, available FROM inventory_shards
+    WHERE product = %(product)s
+    ORDER BY shard
+    FOR UPDATE
+"""
+
+TAKE_FROM_SHARD = """
+    UPDATE inventory_shards SET available = available - %(quantity)s
+    WHERE product = %(product)s AND shard = %(shard)s
+"""
+
+HOLD = """
+    INSERT INTO inventory_reservations (order_id, shard, product, quantity, expires_at)
+    VALUES (%(order_id)s, %(shard)s, %(product)s, %(quantity)s,
+            CURRENT_TIMESTAMP + %(ttl)s * INTERVAL '1 second')
+"""
+
+# Holds the sweeper already expired are skipped, the caller compares the count
+CONFIRM = """
+    UPDATE inventory_reservations SET status = 'confirmed', expires_at = NULL
+    WHERE order_id = %(order_id)s AND status = 'held'
+"""
+
+# Ends the reservations matched by {where}, skipping any another transaction holds
+END_HOLDS = """
+    UPDATE inventory_reservations SET status = %(status)s
+    WHERE (order_id, shard) IN (
+        SELECT order_id, shard FROM inventory_reservations
+        WHERE {where}
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING order_id, product, shard, quantity
+"""
+
+# Lock the shards being restocked in the same order as LOCK_SHARDS, so restocking and
+# split reservations cannot deadlock
+LOCK_RESTOCKED_SHARDS = """
+    SELECT 1 FROM inventory_shards
+    WHERE (product, shard) IN (
+        SELECT * FROM unnest(%(products)s::varchar[], %(shards)s::integer[])
+    )
+    ORDER BY product, shard
+    FOR UPDATE
+"""
+
+RESTOCK = """
+    UPDATE inventory_shards AS s SET available = s.available + r.quantity
+    FROM unnest(%(products)s::varchar[], %(shards)s::integer[], %(quantities)s::integer[])
+        AS r (product, shard, quantity)
+    WHERE s.product = r.product AND s.shard = r.shard
+"""
+
+# An order whose stock goes back is dropped with it, so stock taken always matches orders stored
+DROP_ORDERS = "DELETE FROM orders WHERE order_id = ANY(%(order_ids)s)"
+
+
+class OutOfStock(Exception):
+    """Not enough stock left for the requested quantity"""
+
+    def __init__(self, product, requested, available):
+        super().__init__(f"Insufficient stock for {product}: requested {requested}, available {available}")
+        self.product = product
+        self.requested = requested
+        self.available = available
+
+
+class UnknownProduct(Exception):
+    """The product has no stock rows, i.e. the catalog does not sell it"""
+
+    def __init__(self, product):
+        super().__init__(f"Unknown product: {product}")
+        self.product = product
+
+
+def reserve(cursor, service_name, order_id, product, quantity, ttl=RESERVATION_TTL):
+    """
+    Take ``quantity`` of ``product`` off its stock shards and hold it for ``order_id``
+    until confirm() or, failing that, expiry; returns the number of holds. Runs in the
+    caller's transaction, so the stock is only taken if the caller commits. Raises
+    OutOfStock or UnknownProduct.
+    """
+    started = time.monotonic()
+    params = {"order_id": order_id, "product": product, "quantity": quantity, "ttl": ttl}
+    path = 'free_shard'
+    cursor.execute(RESERVE_FROM_FREE_SHARD, params)
+    row = cursor.fetchone()
+    if row is None:
+        path = 'locked_shard'
+        cursor.execute(RESERVE_FROM_ONE_SHARD, params)
+        row = cursor.fetchone()
+
+    if row is not None:
+        cursor.execute(HOLD, {**params, "shard": row[0]})
+        holds = 1
+    else:
+        path = 'split'
+        try:
+            holds = _reserve_across_shards(cursor, params)
+        except OutOfStock:
+            RESERVATIONS.labels(app_name=service_name, outcome='out_of_stock').inc()
+            raise
+        except UnknownProduct:
+            RESERVATIONS.labels(app_name=service_name, outcome='unknown_product').inc()
+            raise
+
+    RESERVATIONS.labels(app_name=service_name, outcome='reserved').inc()
+    RESERVATION_LATENCY.labels(app_name=service_name, path=path).observe(time.monotonic() - started)
+    return holds
+
+
+def _reserve_across_shards(cursor, params):
+    cursor.execute(LOCK_SHARDS, params)
+    shards = cursor.fetchall()
+    if not shards:
+        raise UnknownProduct(params["product"])
+    available = sum(stock for _, stock in shards)
+    if available < params["quantity"]:
+        raise OutOfStock(params["product"], params["quantity"], available)
+
+    needed = params["quantity"]
+    holds = 0
+    for shard, stock in shards:
+        if needed == 0:
+            break
+        take = min(stock, needed)
+        if take:
+            cursor.execute(TAKE_FROM_SHARD, {**params, "shard": shard, "quantity": take})
+            cursor.execute(HOLD, {**params, "shard": shard, "quantity": take})
+            needed -= take
+            holds += 1
+    return holds
+
+
+def confirm(cursor, order_id, holds):
+    """
+    Keep the order's held stock for good once the order is published; ``holds`` is the
+    count reserve() returned. False if some already expired, in which case the rest of
+    the stock goes back too, since the sweeper has dropped the order.
+    """
+    cursor.execute(CONFIRM, {"order_id": order_id})
+    if cursor.rowcount == holds:
+        return True
+    release(cursor, order_id)
+    return False
+
+
+def release(cursor, order_id):
+    """Drop an order that will not be published and return its stock, held or confirmed"""
+    released = _return_stock(
+        cursor, "order_id = %(order_id)s AND status IN ('held', 'confirmed')",
+        {"order_id": order_id, "status": 'released', "limit": 1000}
+    )
+    cursor.execute(DROP_ORDERS, {"order_ids": [order_id]})
+    return released
+
+
+def expire(cursor, limit=RESERVATION_SWEEP_BATCH):
+    """Return the stock of up to ``limit`` holds past their expiry, dropping their orders"""
+    return _return_stock(
+        cursor, "status = 'held' AND expires_at < CURRENT_TIMESTAMP",
+        {"status": 'expired', "limit": limit}
+    )
+
+
+def _return_stock(cursor, where, params):
+    cursor.execute(END_HOLDS.format(where=where), params)
+    ended = cursor.fetchall()
+    if not ended:
+        return 0
+    returned = defaultdict(int)
+    for _, product, shard, quantity in ended:
+        returned[(product, shard)] += quantity
+    shards = sorted(returned)
+    restock = {
+        "products": [product for product, _ in shards],
+        "shards": [shard for _, shard in shards],
+        "quantities": [returned[key] for key in shards],
+    }
+    cursor.execute(LOCK_RESTOCKED_SHARDS, restock)
+    cursor.execute(RESTOCK, restock)
+    cursor.execute(DROP_ORDERS, {"order_ids": sorted({order_id for order_id, *_ in ended})})
+    return len(ended)
+
+
+class ReservationSweeper:
+    """
+    Returns expired holds to stock on a background thread every ``interval`` seconds.
+    Every worker runs one; SKIP LOCKED keeps them from sweeping the same holds.
+    """
+
+    def __init__(self, service_name, logger, connect, interval=RESERVATION_SWEEP_INTERVAL):
+        self.service_name = service_name
+        self.logger = logger
+        self.connect = connect
+        self.interval = interval
+        self._thread = None
+        self._forked = False
+        os.register_at_fork(after_in_child=self._restart_after_fork)
+
+    def start(self):
+        """Start the sweeper thread unless it is already running"""
+        if INIT_AFTER_FORK and not self._forked:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._run, name=f'{self.service_name}-reservation-sweeper', daemon=True
+        )
+        self._thread.start()
+
+    def _restart_after_fork(self):
+        # A worker forked from the gunicorn master does not inherit the sweeper thread
+        self._thread = None
+        self._forked = True
+        self.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                self.logger.warning(f"Reservation sweep failed: {str(e)}")
+
+    def sweep(self):
+        """Expire holds in batches until none are left, returning how many expired"""
+        total = 0
+        conn = self.connect()
+        try:
+            while True:
+                with conn.cursor() as cursor:
+                    expired = expire(cursor)
+                conn.commit()
+                total += expired
+                if expired < RESERVATION_SWEEP_BATCH:
+                    break
+        finally:
+            conn.close()
+        if total:
+            RESERVATIONS_EXPIRED.labels(app_name=self.service_name).inc(total)
+            self.logger.info(f"Returned {total} expired reservations to stock")
+        return total
@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+
+from utils.startup import INIT_AFTER_FORK
+
+# Set by gunicorn-config.py when it runs several workers: each worker writes its metrics
+# to files in this directory and /metrics aggregates them, whichever worker serves it
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+# How often each worker writes the gauges registered with gauge_function in that mode
+METRICS_REFRESH_INTERVAL = float(os.getenv('METRICS_REFRESH_INTERVAL', '5'))
+
+# Gauge children and the functions giving their values, written by the refresh thread
+_functions = {}
+_thread = None
+_forked = False
+
+
+def gauge_function(gauge, func):
+    """
+    Report ``func()`` as the value of ``gauge`` (a labelled child). In a single process it
+    is read at scrape time; with several workers, each writes its own value periodically,
+    since files cannot call back into the worker that owns them.
+    """
+    if not MULTIPROC_DIR:
+        gauge.set_function(func)
+        return
+    _functions[gauge] = func
+    _ensure_started()
+
+
+def _ensure_started():
+    global _thread
+    # The gunicorn master (preload_app) serves no requests and owns no live gauges
+    if INIT_AFTER_FORK and not _forked:
+        return
+    if _thread is not None and _thread.is_alive():
+        return
+    _thread = threading.Thread(target=_run, name='metrics-refresh', daemon=True)
+    _thread.start()
+
+
+def _restart_after_fork():
+    global _thread, _forked
+    _thread = None
+    _forked = True
+    if _functions:
+        _ensure_started()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _run():
+    while True:
+        for gauge, func in list(_functions.items()):
+            try:
+                gauge.set(func())
+            except Exception:
+                pass
+        time.sleep(METRICS_REFRESH_INTERVAL)
+
+
+def metrics_response():
+    """Body, status and headers for /metrics, covering every worker in multiprocess mode"""
+    registry = REGISTRY
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), 200, {'Content-Type': CONTENT_TYPE_LATEST}
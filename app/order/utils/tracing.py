@@ -0,0 +1,359 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+import urllib.request
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, request
+from prometheus_client import Counter
+
+# Traces go next to the service's logs
+from utils.logger import parent_dir
+
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+# file: one OTLP/JSON export request per line, readable by the collector's otlpjsonfile receiver
+# otlp: POST to an OTLP/HTTP collector at OTEL_EXPORTER_OTLP_ENDPOINT
+TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'file')
+TRACE_FILE = os.getenv('TRACE_FILE')
+# The file rotates like the service logs, keeping TRACE_FILE_BACKUPS older files
+TRACE_FILE_MAX_BYTES = int(os.getenv('TRACE_FILE_MAX_BYTES', str(10 * 1024 * 1024)))
+TRACE_FILE_BACKUPS = int(os.getenv('TRACE_FILE_BACKUPS', '5'))
+OTLP_ENDPOINT = os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT', 'http://localhost:4318').rstrip('/') + '/v1/traces'
+# Share of new traces that are recorded; traces started upstream keep the caller's decision
+TRACE_SAMPLE_RATIO = float(os.getenv('TRACE_SAMPLE_RATIO', '1.0'))
+TRACE_QUEUE_SIZE = int(os.getenv('TRACE_QUEUE_SIZE', '10000'))
+TRACE_EXPORT_INTERVAL = float(os.getenv('TRACE_EXPORT_INTERVAL', '2'))
+TRACE_BATCH_SIZE = 512
+
+TRACEPARENT = 'traceparent'
+# Probes and scrapes would only add noise
+UNTRACED_PATHS = frozenset(('/health', '/metrics', '/livez', '/readyz'))
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT, PRODUCER, CONSUMER = 1, 2, 3, 4, 5
+
+# Metrics
+SPANS_EXPORTED = Counter(
+    'trace_spans_exported_total', 'Spans written to the trace exporter',
+    ['app_name']
+)
+SPANS_DROPPED = Counter(
+    'trace_spans_dropped_total', 'Spans dropped before being exported',
+    ['app_name', 'reason']
+)
+
+# Context of the span the current thread (or greenlet) is working in
+_current = ContextVar('trace_span_context', default=None)
+
+
+class SpanContext(namedtuple('SpanContext', ['trace_id', 'span_id', 'sampled'])):
+    """Identifies a span, propagated as a W3C traceparent header"""
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def _is_hex(value, length):
+    return len(value) == length and not value.strip('0123456789abcdef')
+
+
+def parse_traceparent(value):
+    """SpanContext from a traceparent header value, or None if it is missing or invalid"""
+    if not value:
+        return None
+    parts = value.strip().lower().split('-')
+    if len(parts) < 4:
+        return None
+    version, trace_id, span_id, flags = parts[:4]
+    # Later versions may append fields, version 00 may not
+    if not _is_hex(version, 2) or version == 'ff' or (version == '00' and len(parts) != 4):
+        return None
+    if not _is_hex(trace_id, 32) or trace_id == '0' * 32 or not _is_hex(span_id, 16) or span_id == '0' * 16:
+        return None
+    if not _is_hex(flags, 2):
+        return None
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & 1))
+
+
+def current_context():
+    """Context of the active span, or None outside one"""
+    return _current.get()
+
+
+def inject(headers):
+    """Add the active span's traceparent to ``headers`` and return them"""
+    context = _current.get()
+    if context is not None:
+        headers[TRACEPARENT] = context.traceparent()
+    return headers
+
+
+def extract(headers):
+    """Remote parent from ``headers`` (HTTP or AMQP), or None"""
+    if not headers:
+        return None
+    value = headers.get(TRACEPARENT)
+    if isinstance(value, bytes):
+        value = value.decode('ascii', 'replace')
+    return parse_traceparent(value)
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        encoded = {"boolValue": value}
+    elif isinstance(value, int):
+        encoded = {"intValue": str(value)}
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+
+class Span:
+    """A timed operation; ended spans of sampled traces go to the tracer's exporter"""
+
+    def __init__(self, tracer, name, context, parent_id, kind, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exc):
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.context.sampled:
+            self.tracer.exporter.export(self)
+
+    def to_otlp(self):
+        return {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+
+
+class SpanExporter:
+    """
+    Batches ended spans on a background thread and writes them as OTLP/JSON, either
+    to a local file or to an OTLP/HTTP collector. Request threads only enqueue; spans
+    are dropped and counted when the queue is full.
+    """
+
+    def __init__(self, service_name, exporter=TRACE_EXPORTER, path=TRACE_FILE):
+        self.service_name = service_name
+        self.exporter = exporter
+        self.path = path or f"{parent_dir}/logs_and_metrics/{service_name}/traces.jsonl"
+        self._queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+        atexit.register(self.flush)
+
+    def export(self, span):
+        if self.exporter == 'none':
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            SPANS_DROPPED.labels(app_name=self.service_name, reason='queue_full').inc()
+
+    def _ensure_started(self):
+        # Started by the first span, so a gunicorn master that never serves starts none
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name=f'{self.service_name}-trace-exporter', daemon=True
+                )
+                self._thread.start()
+
+    def _reset_after_fork(self):
+        # Threads do not survive fork, spans queued in the parent are the parent's to export
+        self._queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            time.sleep(TRACE_EXPORT_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """Export every queued span"""
+        while True:
+            batch = []
+            try:
+                while len(batch) < TRACE_BATCH_SIZE:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self._write(batch)
+            if len(batch) < TRACE_BATCH_SIZE:
+                return
+
+    def _write(self, spans):
+        payload = json.dumps({
+            "resourceSpans": [{
+                "resource": {"attributes": [_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "ecommerce"},
+                    "spans": [span.to_otlp() for span in spans],
+                }],
+            }]
+        })
+        try:
+            if self.exporter == 'otlp':
+                export_request = urllib.request.Request(
+                    OTLP_ENDPOINT, data=payload.encode('utf-8'),
+                    headers={'Content-Type': 'application/json'}, method='POST'
+                )
+                with urllib.request.urlopen(export_request, timeout=5):
+                    pass
+            else:
+                self._append(payload + '\n')
+            SPANS_EXPORTED.labels(app_name=self.service_name).inc(len(spans))
+        except Exception:
+            SPANS_DROPPED.labels(app_name=self.service_name, reason='export_failed').inc(len(spans))
+
+
+    def _append(self, line):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        if size and size + len(line) > TRACE_FILE_MAX_BYTES:
+            self._rotate()
+        with open(self.path, 'a') as f:
+            f.write(line)
+
+    def _rotate(self):
+        # Same naming as RotatingFileHandler: traces.jsonl.1 is the most recent backup.
+        # Workers share the file, so another one may have rotated it already
+        try:
+            for index in range(TRACE_FILE_BACKUPS - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{index}"):
+                    os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+            if TRACE_FILE_BACKUPS > 0:
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class Tracer:
+    """Starts spans for one service, parented on the active span unless told otherwise"""
+
+    def __init__(self, service_name, sample_ratio=TRACE_SAMPLE_RATIO):
+        self.service_name = service_name
+        self.sample_ratio = sample_ratio
+        self.exporter = SpanExporter(service_name, TRACE_EXPORTER if TRACING_ENABLED else 'none')
+
+    def start_span(self, name, kind=INTERNAL, parent=None, attributes=None):
+        """Start a span; the caller ends it. ``parent`` defaults to the active span"""
+        parent = parent or _current.get()
+        if parent is not None:
+            context = SpanContext(parent.trace_id, secrets.token_hex(8), parent.sampled)
+        else:
+            sampled = TRACING_ENABLED and random.random() < self.sample_ratio
+            context = SpanContext(secrets.token_hex(16), secrets.token_hex(8), sampled)
+        return Span(self, name, context, parent.span_id if parent else None, kind, attributes)
+
+    @contextmanager
+    def span(self, name, kind=INTERNAL, parent=None, attributes=None):
+        """Run the block in a new active span, marking it failed if the block raises"""
+        span = self.start_span(name, kind, parent, attributes)
+        token = _current.set(span.context)
+        try:
+            yield span
+        except Exception as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current.reset(token)
+            span.end()
+
+
+class TraceContextFilter(logging.Filter):
+    """Adds the active span's trace_id and span_id to log records"""
+
+    def filter(self, record):
+        context = _current.get()
+        if context is not None:
+            record.trace_id = context.trace_id
+            record.span_id = context.span_id
+        return True
+
+
+def install_tracing(app, service_name, logger):
+    """
+    Continue the caller's trace (traceparent header) or start one for each request,
+    tag the service's logs with it, and return the service's Tracer for inner spans
+    """
+    tracer = Tracer(service_name)
+    logger.addFilter(TraceContextFilter())
+
+    @app.before_request
+    def start_request_span():
+        if request.path in UNTRACED_PATHS:
+            return
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        span = tracer.start_span(
+            f"{request.method} {route}", kind=SERVER, parent=extract(request.headers),
+            attributes={"http.request.method": request.method, "http.route": route}
+        )
+        g.trace_span = span
+        g.trace_token = _current.set(span.context)
+
+    @app.after_request
+    def tag_response(response):
+        span = g.get('trace_span')
+        if span is not None:
+            span.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code >= 500:
+                span.error = f"HTTP {response.status_code}"
+            response.headers['X-Trace-Id'] = span.context.trace_id
+        return response
+
+    @app.teardown_request
+    def end_request_span(exc):
+        span = g.pop('trace_span', None)
+        if span is None:
+            return
+        if exc is not None:
+            span.record_exception(exc)
+        _current.reset(g.pop('trace_token'))
+        span.end()
+
+    return tracer
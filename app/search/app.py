@@ -1,35 +1,94 @@
 import json
 from flask import Flask, jsonify, request
-from elasticsearch import Elasticsearch
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST, start_http_server
+from elasticsearch import ApiError, Elasticsearch
+from elastic_transport import ConnectionError as TransportConnectionError, JsonSerializer
+from prometheus_client import Counter, Histogram, start_http_server
 import os
 import sys
 import time
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.logger import setup_logger
+from utils.json_provider import install_json_provider
+from utils.startup import DependencyInitializer
+from utils.metrics import metrics_response
+from utils.health import HEALTH_CHECK_TIMEOUT, HealthMonitor
+from utils.admission import install_admission
+from utils.tracing import CLIENT, install_tracing
+from utils.resilience import CircuitBreaker, DependencyUnavailable, install_resilience, remaining
 
 # Initialize Flask app
 app = Flask(__name__)
+install_json_provider(app)
+install_admission(app, 'search')
+install_resilience(app, 'search')
 
 # Initialize logger
 logger = setup_logger('search')
+tracer = install_tracing(app, 'search', logger)
 
 # Elasticsearch configuration
 ES_HOST = os.getenv('ELASTICSEARCH_HOST', 'elasticsearch.logging.svc.cluster.local')
 ES_PORT = os.getenv('ELASTICSEARCH_PORT', '9200')
 ES_URL = f"http://{ES_HOST}:{ES_PORT}"
+# Upper bound for a single search, requests are further limited by their deadline.
+# Timeouts are not retried, they would only outlive the caller.
+ES_TIMEOUT = float(os.getenv('ELASTICSEARCH_TIMEOUT', '5'))
+ES_MAX_RETRIES = int(os.getenv('ELASTICSEARCH_MAX_RETRIES', '1'))
 
 # Initialize Elasticsearch client with retry configuration
 es = Elasticsearch(
     [ES_URL],
-    retry_on_timeout=True,
-    max_retries=3,
-    timeout=30
+    retry_on_timeout=False,
+    max_retries=ES_MAX_RETRIES,
+    request_timeout=ES_TIMEOUT
+)
+
+# Client errors such as a malformed query say nothing about the cluster's health
+es_breaker = CircuitBreaker(
+    'search', 'elasticsearch',
+    is_failure=lambda e: not (isinstance(e, ApiError) and e.meta.status < 500)
 )
 
 # Elasticsearch index name
 INDEX_NAME = "products"
 
+# Pass the ES response bytes straight through instead of decoding and re-encoding them.
+# SEARCH_FILTER_PATH is sent as filter_path so ES drops unneeded fields itself and must
+# select fields under "hits".
+SEARCH_RAW_PASSTHROUGH = os.getenv('SEARCH_RAW_PASSTHROUGH', 'false').lower() == 'true'
+SEARCH_FILTER_PATH = os.getenv('SEARCH_FILTER_PATH', 'hits')
+HITS_PREFIX = b'{"hits":'
+
+
+class RawJSONSerializer(JsonSerializer):
+    """Leaves response bodies as bytes so /search can return them undecoded"""
+
+    def loads(self, data):
+        return bytes(data)
+
+
+# Client used only for passthrough searches, sharing the main client's settings
+es_raw = Elasticsearch(
+    [ES_URL],
+    retry_on_timeout=False,
+    max_retries=ES_MAX_RETRIES,
+    request_timeout=ES_TIMEOUT,
+    serializers={
+        'application/json': RawJSONSerializer(),
+        'application/vnd.elasticsearch+json': RawJSONSerializer(),
+    }
+)
+
+
+def raw_hits(body):
+    """
+    Return the bytes of the "hits" object from a filter_path'd search response,
+    falling back to a decode/re-encode if the body is not in the expected shape
+    """
+    if body.startswith(HITS_PREFIX) and body.endswith(b'}'):
+        return body[len(HITS_PREFIX):-1]
+    return app.json.dumps(app.json.loads(body).get('hits', {})).encode('utf-8')
+
 # Define Prometheus metrics
 REQUEST_COUNT = Counter(
     'request_count', 'App Request Count',
@@ -93,6 +152,40 @@ def initialize_index():
         SEARCH_ERRORS.labels(error_type="es_init").inc()
         raise
 
+# Dependencies are initialized in the background, see /readyz
+initializer = DependencyInitializer('search', logger)
+initializer.add_step('index', initialize_index)
+
+def check_elasticsearch():
+    """Health check: ping the cluster"""
+    if not es.options(request_timeout=HEALTH_CHECK_TIMEOUT, max_retries=0).ping():
+        raise ConnectionError("Elasticsearch ping failed")
+    return "connected"
+
+def check_index():
+    """Health check: the products index exists"""
+    exists = es.options(request_timeout=HEALTH_CHECK_TIMEOUT, max_retries=0).indices.exists(index=INDEX_NAME)
+    return "exists" if exists else "missing"
+
+# Dependencies are probed in the background, /health serves the cached results
+health_monitor = HealthMonitor('search', logger)
+health_monitor.add_check('elasticsearch', check_elasticsearch)
+health_monitor.add_check('index', check_index, healthy_status='exists', failure_status='unknown')
+
+def search_with_retries(client, **kwargs):
+    """
+    Search, retrying up to ES_MAX_RETRIES times when Elasticsearch could not be reached.
+    Each attempt may use all the time left, a timed out attempt is not retried.
+    """
+    for attempt in range(ES_MAX_RETRIES + 1):
+        timeout = remaining('elasticsearch', ES_TIMEOUT)
+        try:
+            return client.options(request_timeout=timeout, max_retries=0).search(**kwargs)
+        except TransportConnectionError as e:
+            if attempt == ES_MAX_RETRIES:
+                raise
+            logger.warning(f"Elasticsearch unreachable, retrying search: {str(e)}")
+
 @app.route('/search', methods=['GET'])
 def search():
     """
@@ -116,59 +209,76 @@ def search():
             }
         }
         
-        result = es.search(index=INDEX_NAME, body=search_query)
+        with tracer.span('elasticsearch.search', kind=CLIENT, attributes={"db.system": "elasticsearch"}), es_breaker:
+            if SEARCH_RAW_PASSTHROUGH:
+                result = search_with_retries(es_raw, index=INDEX_NAME, body=search_query, filter_path=SEARCH_FILTER_PATH)
+            else:
+                result = search_with_retries(es, index=INDEX_NAME, body=search_query)
+        # Encoding the response is not an Elasticsearch call, so it stays outside the breaker
+        if SEARCH_RAW_PASSTHROUGH:
+            response = app.response_class(raw_hits(result.body), mimetype='application/json')
+        else:
+            response = jsonify(result['hits'])
         
         REQUEST_LATENCY.labels(app_name='search', endpoint='/search').observe(time.time() - start_time)
         REQUEST_COUNT.labels(app_name='search', method='GET', endpoint='/search', http_status=200).inc()
         
         logger.info(f"Search completed for query: {query}")
-        return jsonify(result['hits']), 200
+        return response, 200
         
+    except DependencyUnavailable as e:
+        logger.warning(f"Search rejected: {str(e)}")
+        SEARCH_ERRORS.labels(error_type="unavailable").inc()
+        REQUEST_COUNT.labels(app_name='search', method='GET', endpoint='/search', http_status=e.status_code).inc()
+        raise
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
         SEARCH_ERRORS.labels(error_type="search").inc()
         REQUEST_COUNT.labels(app_name='search', method='GET', endpoint='/search', http_status=500).inc()
         return jsonify({"error": "Search operation failed"}), 500
 
+@app.route('/livez')
+def livez():
+    """Liveness probe: the process is up and serving requests"""
+    return jsonify({"status": "alive"}), 200
+
+@app.route('/readyz')
+def readyz():
+    """Readiness probe: every dependency has been initialized"""
+    if initializer.ready():
+        return jsonify({"status": "ready"}), 200
+    return jsonify({"status": "initializing", "dependencies": initializer.status()}), 503
+
 @app.route('/metrics')
 def metrics():
     """
     Metrics endpoint for Prometheus
     """
-    logger.info("Metrics endpoint called - search service")
-    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+    logger.info("Metrics endpoint called - search service", extra={"sample_key": "/metrics"})
+    return metrics_response()
 
 @app.route('/health')
 def health():
     """
-    Health check endpoint
+    Health check endpoint, serves the latest cached dependency checks
     """
-    logger.info("Health check endpoint called - search service")
+    logger.info("Health check endpoint called - search service", extra={"sample_key": "/health"})
     try:
-        # Check Elasticsearch connection
-        if es.ping():
-            logger.info("Elasticsearch ping successful")
-            # Check if index exists
-            if es.indices.exists(index=INDEX_NAME):
-                logger.info(f"Index {INDEX_NAME} exists")
-                return jsonify({
-                    "status": "healthy",
-                    "elasticsearch": "connected",
-                    "index": "exists"
-                }), 200
-            else:
-                logger.warning(f"Index {INDEX_NAME} is missing")
-                return jsonify({
-                    "status": "degraded",
-                    "elasticsearch": "connected",
-                    "index": "missing"
-                }), 200
-        else:
-            logger.error("Elasticsearch ping failed")
+        checks = health_monitor.snapshot()
+        elasticsearch = checks["elasticsearch"]["status"]
+        index = checks["index"]["status"]
+        if elasticsearch == "disconnected":
             return jsonify({
                 "status": "unhealthy",
-                "elasticsearch": "disconnected"
+                "elasticsearch": elasticsearch,
+                "checks": checks
             }), 200 # TODO: change to 500 to ensure our health check is working
+        return jsonify({
+            "status": "healthy" if index == "exists" else "degraded",
+            "elasticsearch": elasticsearch,
+            "index": index,
+            "checks": checks
+        }), 200
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
         return jsonify({
@@ -181,15 +291,15 @@ def create_app():
     Application factory function
     """
     logger.info("Creating app for Gunicorn: %s", 'search-service')
+    # Bind immediately, the index is initialized in the background with backoff
+    initializer.start()
+    health_monitor.start()
     return app
 
 # For Gunicorn
 application = create_app()
 
 if __name__ == "__main__":
-    # Initialize Elasticsearch index
-    initialize_index()
-    
     # Start metrics server - TODO: we are using metrics server with the service's metrics endpoint!
     # start_http_server(8003)
     
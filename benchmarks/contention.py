@@ -0,0 +1,348 @@
+"""
+Compare stock reservation strategies on a single hot product
+
+Every thread places orders for the same product against a real Postgres, each order
+being one transaction that takes stock and inserts the order row:
+- naive: one stock row per product, UPDATE ... SET available = available - n
+- sharded: the order service's reservation (app/order/utils/inventory.py), stock
+  split over --shards rows, followed by the transaction that confirms the order once
+  published. --cancel-ratio of these orders are cancelled instead, as if publishing
+  failed, and --abandon-ratio are never confirmed and left for a reservation sweeper
+  running alongside
+
+Tables are created in a scratch schema (--schema) that is dropped afterwards. After
+each run the stock taken is checked against the orders stored, so overselling fails
+the run (exit code 1).
+
+Usage:
+    POSTGRES_HOST=localhost POSTGRES_PASSWORD=... python benchmarks/contention.py --threads 64 --duration 10
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import psycopg2
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ORDER_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'app', 'order')
+
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ORDER_DIR)
+from loadgen import percentile  # noqa: E402
+from utils import inventory  # noqa: E402
+
+PRODUCT = 'Laptop'
+
+SCHEMA = """
+    CREATE TABLE orders (
+        id SERIAL PRIMARY KEY,
+        order_id VARCHAR(255) NOT NULL,
+        product VARCHAR(255) NOT NULL,
+        quantity INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX orders_order_id ON orders (order_id);
+    CREATE TABLE inventory_naive (
+        product VARCHAR(255) PRIMARY KEY,
+        available INTEGER NOT NULL CHECK (available >= 0)
+    );
+    CREATE TABLE inventory_shards (
+        product VARCHAR(255) NOT NULL,
+        shard INTEGER NOT NULL,
+        available INTEGER NOT NULL CHECK (available >= 0),
+        PRIMARY KEY (product, shard)
+    );
+"""
+
+INSERT_ORDER = "INSERT INTO orders (order_id, product, quantity) VALUES (%s, %s, %s)"
+
+NAIVE_RESERVE = """
+    UPDATE inventory_naive SET available = available - %(quantity)s
+    WHERE product = %(product)s AND available >= %(quantity)s
+    RETURNING available
+"""
+
+
+def connect(args):
+    return psycopg2.connect(
+        host=os.getenv('POSTGRES_HOST', 'localhost'),
+        port=os.getenv('POSTGRES_PORT', '5432'),
+        database=os.getenv('POSTGRES_DB', 'postgres'),
+        user=os.getenv('POSTGRES_USER', 'postgres'),
+        password=os.getenv('POSTGRES_PASSWORD', ''),
+        options=f'-c search_path={args.schema}'
+    )
+
+
+def reset_schema(args):
+    """Recreate the scratch schema with args.stock units of PRODUCT"""
+    conn = connect(args)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {args.schema} CASCADE')
+            cursor.execute(f'CREATE SCHEMA {args.schema}')
+            cursor.execute(SCHEMA)
+            cursor.execute(inventory.RESERVATIONS_TABLE)
+            cursor.execute("INSERT INTO inventory_naive VALUES (%s, %s)", (PRODUCT, args.stock))
+            share, extra = divmod(args.stock, args.shards)
+            for shard in range(args.shards):
+                cursor.execute(
+                    "INSERT INTO inventory_shards VALUES (%s, %s, %s)",
+                    (PRODUCT, shard, share + (shard < extra))
+                )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def drop_schema(args):
+    conn = connect(args)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {args.schema} CASCADE')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def place_naive(conn, order_id, quantity, args, fate):
+    with conn.cursor() as cursor:
+        cursor.execute(NAIVE_RESERVE, {"product": PRODUCT, "quantity": quantity})
+        if cursor.fetchone() is None:
+            raise inventory.OutOfStock(PRODUCT, quantity, None)
+        time.sleep(args.hold_ms / 1000)
+        cursor.execute(INSERT_ORDER, (order_id, PRODUCT, quantity))
+    conn.commit()
+    return 'ok'
+
+
+def place_sharded(conn, order_id, quantity, args, fate):
+    with conn.cursor() as cursor:
+        holds = inventory.reserve(cursor, 'benchmark', order_id, PRODUCT, quantity, ttl=args.ttl)
+        time.sleep(args.hold_ms / 1000)
+        cursor.execute(INSERT_ORDER, (order_id, PRODUCT, quantity))
+    conn.commit()
+    # The order service publishes here, then confirms or, if publishing failed, cancels
+    if fate == 'abandoned':
+        return fate
+    with conn.cursor() as cursor:
+        if fate == 'cancelled':
+            inventory.release(cursor, order_id)
+        elif not inventory.confirm(cursor, order_id, holds):
+            fate = 'expired'
+    conn.commit()
+    return fate
+
+
+STRATEGIES = {'naive': place_naive, 'sharded': place_sharded}
+
+
+def check_stock(args, strategy):
+    """Stock taken must equal the quantity of the orders stored; returns a problem or None"""
+    conn = connect(args)
+    try:
+        with conn.cursor() as cursor:
+            table = 'inventory_naive' if strategy == 'naive' else 'inventory_shards'
+            cursor.execute(f"SELECT COALESCE(SUM(available), 0) FROM {table}")
+            available = cursor.fetchone()[0]
+            cursor.execute("SELECT COALESCE(SUM(quantity), 0) FROM orders")
+            ordered = cursor.fetchone()[0]
+        conn.rollback()
+    finally:
+        conn.close()
+    if available + ordered != args.stock:
+        return f"{strategy}: {args.stock} in stock, {available} left but {ordered} ordered"
+    if available < 0:
+        return f"{strategy}: negative stock {available}"
+    return None
+
+
+def sweep(args, stop, counts):
+    """Expire abandoned holds until ``stop`` is set, like the order service's sweeper"""
+    conn = connect(args)
+    try:
+        while not stop.wait(args.sweep_interval):
+            try:
+                with conn.cursor() as cursor:
+                    counts['expired'] += inventory.expire(cursor)
+                conn.commit()
+            except psycopg2.Error:
+                conn.rollback()
+                counts['errors'] += 1
+    finally:
+        conn.close()
+
+
+def fate_of(rng, args, strategy):
+    if strategy == 'naive':
+        return 'ok'
+    draw = rng.random()
+    if draw < args.cancel_ratio:
+        return 'cancelled'
+    if draw < args.cancel_ratio + args.abandon_ratio:
+        return 'abandoned'
+    return 'ok'
+
+
+def run_strategy(args, strategy):
+    """Place orders from args.threads threads for args.duration seconds after a warmup"""
+    place = STRATEGIES[strategy]
+    reset_schema(args)
+    samples = []
+    lock = threading.Lock()
+    timing = {}
+    stop_sweeper = threading.Event()
+    sweeps = {'expired': 0, 'errors': 0}
+    sweeper = None
+    if strategy == 'sharded' and args.abandon_ratio:
+        sweeper = threading.Thread(target=sweep, args=(args, stop_sweeper, sweeps))
+        sweeper.start()
+
+    def start_clock():
+        # Runs once every thread has connected, so connecting is not part of the run
+        now = time.monotonic()
+        timing['measure_from'] = now + args.warmup
+        timing['end'] = now + args.warmup + args.duration
+
+    start = threading.Barrier(args.threads + 1, action=start_clock)
+
+    def worker(seed):
+        rng = random.Random(seed)
+        conn = connect(args)
+        local = []
+        try:
+            start.wait()
+            while time.monotonic() < timing['end']:
+                order_id = str(uuid.uuid4())
+                began = time.monotonic()
+                try:
+                    outcome = place(conn, order_id, rng.randint(1, args.max_quantity), args,
+                                    fate_of(rng, args, strategy))
+                except inventory.OutOfStock:
+                    conn.rollback()
+                    outcome = 'out_of_stock'
+                except psycopg2.Error:
+                    conn.rollback()
+                    outcome = 'error'
+                if began >= timing['measure_from']:
+                    local.append((time.monotonic() - began, outcome))
+        finally:
+            conn.close()
+            with lock:
+                samples.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(args.seed + i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    for thread in threads:
+        thread.join()
+    stop_sweeper.set()
+    if sweeper is not None:
+        sweeper.join()
+
+    problem = check_stock(args, strategy)
+    latencies = sorted(latency for latency, outcome in samples if outcome == 'ok')
+    count = len(samples)
+    errors = sum(1 for _, outcome in samples if outcome == 'error')
+    return {
+        'orders': len(latencies),
+        'out_of_stock': sum(1 for _, outcome in samples if outcome == 'out_of_stock'),
+        'cancelled': sum(1 for _, outcome in samples if outcome == 'cancelled'),
+        'abandoned': sum(1 for _, outcome in samples if outcome == 'abandoned'),
+        'expired': sweeps['expired'],
+        'sweep_errors': sweeps['errors'],
+        'errors': errors,
+        'error_rate': round(errors / count, 4) if count else 0.0,
+        'throughput_ops': round(len(latencies) / args.duration, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'consistent': problem is None,
+    }, problem
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--strategies', default='naive,sharded', help='comma separated strategies to run')
+    parser.add_argument('--threads', type=int, default=64, help='concurrent order placers')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per strategy')
+    parser.add_argument('--warmup', type=float, default=2, help='unrecorded seconds before measuring')
+    parser.add_argument('--shards', type=int, default=8, help='stock rows per product for the sharded strategy')
+    parser.add_argument('--stock', type=int, default=10_000_000,
+                        help='starting stock; set it low to exercise the split and out-of-stock paths')
+    parser.add_argument('--max-quantity', type=int, default=3)
+    parser.add_argument('--hold-ms', type=float, default=0,
+                        help='time spent between taking stock and committing, e.g. app round trips')
+    parser.add_argument('--cancel-ratio', type=float, default=0,
+                        help='share of sharded orders cancelled after confirming, as on a failed publish')
+    parser.add_argument('--abandon-ratio', type=float, default=0,
+                        help='share of sharded orders never confirmed, left to expire (see --ttl)')
+    parser.add_argument('--ttl', type=int, default=1, help='hold expiry in seconds for abandoned orders')
+    parser.add_argument('--sweep-interval', type=float, default=0.2, help='seconds between sweeps')
+    parser.add_argument('--schema', default='reservation_benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results JSON here instead of stdout')
+    args = parser.parse_args()
+
+    strategies = [s.strip() for s in args.strategies.split(',') if s.strip()]
+    unknown = set(strategies) - set(STRATEGIES)
+    if unknown:
+        parser.error(f"unknown strategies: {', '.join(sorted(unknown))}")
+
+    results = {'strategies': {}}
+    problems = []
+    try:
+        for strategy in strategies:
+            results['strategies'][strategy], problem = run_strategy(args, strategy)
+            if problem:
+                problems.append(problem)
+    finally:
+        drop_schema(args)
+
+    results['meta'] = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'threads': args.threads,
+        'duration': args.duration,
+        'warmup': args.warmup,
+        'shards': args.shards,
+        'stock': args.stock,
+        'max_quantity': args.max_quantity,
+        'hold_ms': args.hold_ms,
+        'cancel_ratio': args.cancel_ratio,
+        'abandon_ratio': args.abandon_ratio,
+        'ttl': args.ttl,
+        'seed': args.seed,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+    }
+
+    payload = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(payload + '\n')
+    else:
+        print(payload)
+
+    print(f"{'strategy':<10} {'ops/s':>9} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'errors':>7}", file=sys.stderr)
+    for strategy, summary in results['strategies'].items():
+        print(f"{strategy:<10} {summary['throughput_ops']:>9} {summary['p50_ms']:>8} "
+              f"{summary['p95_ms']:>8} {summary['p99_ms']:>8} {summary['errors']:>7}", file=sys.stderr)
+
+    if problems:
+        print("Stock does not match the orders placed:", file=sys.stderr)
+        for problem in problems:
+            print(f"  - {problem}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+Open-loop HTTP load generator and result statistics
+
+Requests are issued on a fixed schedule at the target rate regardless of how fast
+responses come back, and latency is measured from the scheduled send time. A slow
+server therefore shows up as higher latency instead of silently lowering the
+offered load (coordinated omission).
+"""
+import http.client
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Endpoint:
+    """One entry of a request mix"""
+
+    def __init__(self, name, port, method, path, weight, body=None):
+        self.name = name
+        self.port = port
+        self.method = method
+        # path and body may be callables so each request can vary
+        self.path = path
+        self.body = body
+        self.weight = weight
+
+    def build(self, rng):
+        path = self.path(rng) if callable(self.path) else self.path
+        body = self.body(rng) if callable(self.body) else self.body
+        return path, body
+
+
+class Recorder:
+    """Thread-safe collection of (endpoint, latency, ok) samples"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, name, latency, ok):
+        with self._lock:
+            self.samples.setdefault(name, []).append((latency, ok))
+
+
+_local = threading.local()
+
+
+def _connection(port):
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    if port not in connections:
+        connections[port] = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    return connections[port]
+
+
+def _send(endpoint, path, body, scheduled, recorder, record):
+    headers = {'Connection': 'keep-alive'}
+    if body is not None:
+        headers['Content-Type'] = 'application/json'
+    ok = False
+    # A kept-alive connection may have been closed by the server (e.g. a recycled
+    # worker), so like other HTTP clients retry once on a fresh connection
+    for attempt in range(2):
+        reused = endpoint.port in getattr(_local, 'connections', {})
+        try:
+            conn = _connection(endpoint.port)
+            conn.request(endpoint.method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            ok = 200 <= response.status < 300
+            if response.getheader('Connection', '').lower() == 'close':
+                _local.connections.pop(endpoint.port).close()
+            break
+        except (OSError, http.client.HTTPException):
+            conn = _local.connections.pop(endpoint.port, None)
+            if conn is not None:
+                conn.close()
+            if not reused:
+                break
+    if record:
+        recorder.add(endpoint.name, time.perf_counter() - scheduled, ok)
+
+
+def run_load(endpoints, rps, duration, warmup=0.0, concurrency=64, seed=0):
+    """
+    Drive the weighted mix at ``rps`` for ``warmup + duration`` seconds.
+    Only requests scheduled after the warmup are recorded.
+    """
+    rng = random.Random(seed)
+    weights = [e.weight for e in endpoints]
+    recorder = Recorder()
+    interval = 1.0 / rps
+    total = int((warmup + duration) * rps)
+    warmup_requests = int(warmup * rps)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        for i in range(total):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            endpoint = rng.choices(endpoints, weights)[0]
+            path, body = endpoint.build(rng)
+            pool.submit(_send, endpoint, path, body, scheduled, recorder, i >= warmup_requests)
+
+    return recorder.samples
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100.0 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(samples, duration):
+    """Per-endpoint and overall latency percentiles, throughput and error rate"""
+
+    def stats(entries):
+        latencies = sorted(latency for latency, _ in entries)
+        errors = sum(1 for _, ok in entries if not ok)
+        count = len(entries)
+        return {
+            "count": count,
+            "errors": errors,
+            "error_rate": round(errors / count, 4) if count else 0.0,
+            "throughput_rps": round((count - errors) / duration, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        }
+
+    endpoints = {name: stats(entries) for name, entries in sorted(samples.items())}
+    everything = [entry for entries in samples.values() for entry in entries]
+    return {"endpoints": endpoints, "total": stats(everything)}
+
+
+def compare(results, baseline, latency_tolerance=0.2, throughput_tolerance=0.1,
+            error_tolerance=0.01, min_latency_delta_ms=1.0):
+    """
+    Return a list of human readable regressions of ``results`` against ``baseline``.
+    Latency regressions smaller than ``min_latency_delta_ms`` are treated as noise.
+    """
+    regressions = []
+    # Throughput per endpoint is only comparable for the same schedule and mix
+    for key in ("rps", "duration", "seed", "services"):
+        if key in baseline.get("meta", {}) and baseline["meta"][key] != results.get("meta", {}).get(key):
+            regressions.append(f"run parameter {key} differs from baseline "
+                               f"({results.get('meta', {}).get(key)} != {baseline['meta'][key]})")
+    for name, base in baseline.get("endpoints", {}).items():
+        current = results["endpoints"].get(name)
+        if current is None:
+            regressions.append(f"{name}: missing from results")
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            limit = base[key] * (1 + latency_tolerance)
+            if current[key] > limit and current[key] - base[key] > min_latency_delta_ms:
+                regressions.append(f"{name}: {key} {current[key]} > {round(limit, 2)} (baseline {base[key]})")
+        floor = base["throughput_rps"] * (1 - throughput_tolerance)
+        if current["throughput_rps"] < floor:
+            regressions.append(f"{name}: throughput_rps {current['throughput_rps']} < {round(floor, 2)} "
+                               f"(baseline {base['throughput_rps']})")
+        if current["error_rate"] > base["error_rate"] + error_tolerance:
+            regressions.append(f"{name}: error_rate {current['error_rate']} > baseline {base['error_rate']}")
+    return regressions
@@ -0,0 +1,108 @@
+"""
+Compare gunicorn worker profiles and recommend one per service
+
+Runs benchmarks/run.py once per profile with GUNICORN_WORKER_PROFILE set, so every
+service boots with that profile from its own gunicorn-config.py. For each service the
+recommended profile is the one with the lowest p99 among runs whose error rate stays
+under --max-error-rate. Profiles whose worker package is not installed are skipped.
+
+Usage:
+    python benchmarks/profiles.py --rps 200 --duration 20 --output profiles.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, BENCH_DIR)
+from run import MIX  # noqa: E402
+
+# profile -> module its worker class needs
+PROFILES = {
+    'sync': None,
+    'gthread': None,
+    'gevent': 'gevent',
+    'eventlet': 'eventlet',
+    'asgi': 'uvicorn',
+}
+
+
+def run_profile(profile, args):
+    env = dict(os.environ, GUNICORN_WORKER_PROFILE=profile)
+    if args.cpus:
+        env['GUNICORN_CPUS'] = str(args.cpus)
+    with tempfile.NamedTemporaryFile(suffix='.json') as output:
+        command = [sys.executable, os.path.join(BENCH_DIR, 'run.py'),
+                   '--rps', str(args.rps), '--duration', str(args.duration),
+                   '--warmup', str(args.warmup), '--output', output.name]
+        if subprocess.call(command, env=env) != 0:
+            return None
+        with open(output.name) as f:
+            return json.load(f)
+
+
+def recommend(results, max_error_rate):
+    """{service: {'profile': best, 'candidates': {profile: endpoint stats}}}"""
+    recommendations = {}
+    for name, service, _, _ in MIX:
+        candidates = {
+            profile: result['endpoints'][name]
+            for profile, result in results.items()
+            if name in result['endpoints']
+        }
+        eligible = {p: s for p, s in candidates.items() if s['error_rate'] <= max_error_rate}
+        best = min(eligible, key=lambda p: (eligible[p]['p99_ms'], -eligible[p]['throughput_rps']),
+                   default=None)
+        recommendations[service] = {'profile': best, 'candidates': candidates}
+    return recommendations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profiles', default=','.join(PROFILES))
+    parser.add_argument('--rps', type=float, default=200)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--cpus', type=float, help='CPU quota to size workers for (GUNICORN_CPUS)')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--output', help='write results JSON here instead of stdout')
+    args = parser.parse_args()
+
+    results = {}
+    for profile in args.profiles.split(','):
+        module = PROFILES.get(profile)
+        if profile not in PROFILES or (module and importlib.util.find_spec(module) is None):
+            print(f"Skipping {profile}: not available", file=sys.stderr)
+            continue
+        print(f"Benchmarking {profile}...", file=sys.stderr)
+        result = run_profile(profile, args)
+        if result is None:
+            print(f"{profile} run failed", file=sys.stderr)
+            continue
+        results[profile] = result
+
+    recommendations = recommend(results, args.max_error_rate)
+    print(f"{'service':<10} {'profile':<10} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'rps':>8} {'errors':>7}",
+          file=sys.stderr)
+    for service, recommendation in recommendations.items():
+        for profile, stats in recommendation['candidates'].items():
+            marker = ' *' if profile == recommendation['profile'] else ''
+            print(f"{service:<10} {profile:<10} {stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8} "
+                  f"{stats['throughput_rps']:>8} {stats['error_rate']:>7}{marker}", file=sys.stderr)
+
+    payload = json.dumps({'recommendations': recommendations, 'runs': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(payload + '\n')
+    else:
+        print(payload)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+Load-test the services against local dependency stand-ins
+
+Boots every service under gunicorn via serve.py, drives a weighted mix of search,
+catalog reads and order creation at a fixed request rate, and writes per-endpoint
+p50/p95/p99, throughput and error rate as JSON. With --baseline the run fails
+(exit code 1) when any endpoint regresses past the configured tolerances.
+
+Usage:
+    python benchmarks/run.py --rps 100 --duration 30 --output results.json
+    python benchmarks/run.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import urllib.parse
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'app')
+
+sys.path.insert(0, BENCH_DIR)
+from loadgen import Endpoint, compare, run_load, summarize  # noqa: E402
+
+# Port offsets from --base-port, mirroring the production ports 5001-5004
+SERVICE_PORTS = {'catalog': 1, 'search': 2, 'order': 3, 'frontend': 4}
+
+# (name, service, method, weight)
+MIX = [
+    ('search', 'search', 'GET', 50),
+    ('catalog_read', 'catalog', 'GET', 30),
+    ('order_create', 'order', 'POST', 15),
+    ('frontend_read', 'frontend', 'GET', 5),
+]
+
+
+def _load_json(*parts):
+    with open(os.path.join(APP_DIR, *parts)) as f:
+        return json.load(f)
+
+
+def build_mix(ports):
+    """Endpoints for the request mix, with request data taken from the services' sample data"""
+    queries = [item['query'] for item in _load_json('search', 'data', 'search_data.json')]
+    products = [item['name'] for item in _load_json('catalog', 'data', 'catalogue_data.json')]
+
+    def search_path(rng):
+        return '/search?q=' + rng.choice(queries).replace(' ', '+').replace('$', '%24')
+
+    def inventory_path(rng):
+        return '/inventory/' + urllib.parse.quote(rng.choice(products))
+
+    def order_body(rng):
+        return json.dumps({'product': rng.choice(products), 'quantity': rng.randint(1, 3)})
+
+    requests = {
+        'search': (search_path, None),
+        'catalog_read': (inventory_path, None),
+        'order_create': ('/order', order_body),
+        'frontend_read': ('/', None),
+    }
+    return [
+        Endpoint(name, ports[service], method, requests[name][0], weight, body=requests[name][1])
+        for name, service, method, weight in MIX
+        if service in ports
+    ]
+
+
+def wait_until_ready(port, timeout):
+    """Poll /readyz until the service reports ready or the timeout expires"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/readyz')
+            status = conn.getresponse().status
+            conn.close()
+            if status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def start_services(services, base_port, real_postgres, log_dir):
+    """Start one serve.py process per service, returning {service: (process, port)}"""
+    os.makedirs(log_dir, exist_ok=True)
+    processes = {}
+    for service in services:
+        port = base_port + SERVICE_PORTS[service]
+        command = [sys.executable, os.path.join(BENCH_DIR, 'serve.py'), service, '--port', str(port)]
+        if real_postgres:
+            command.append('--real-postgres')
+        log = open(os.path.join(log_dir, f'{service}.log'), 'w')
+        processes[service] = (subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT), port)
+    return processes
+
+
+def stop_services(processes):
+    for process, _ in processes.values():
+        process.terminate()
+    for process, _ in processes.values():
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--services', default='catalog,search,order,frontend',
+                        help='comma separated services to boot and load')
+    parser.add_argument('--rps', type=float, default=100, help='target request rate across the mix')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='unrecorded seconds before measuring')
+    parser.add_argument('--concurrency', type=int, default=64, help='maximum in-flight requests')
+    parser.add_argument('--base-port', type=int, default=15000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--real-postgres', action='store_true',
+                        help='use the Postgres configured through POSTGRES_* instead of the fake')
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--log-dir', default=os.path.join(BENCH_DIR, 'logs'))
+    parser.add_argument('--output', help='write results JSON here instead of stdout')
+    parser.add_argument('--baseline', help='fail when results regress against this results JSON')
+    parser.add_argument('--save-baseline', help='also write the results to this path')
+    parser.add_argument('--latency-tolerance', type=float, default=0.2)
+    parser.add_argument('--throughput-tolerance', type=float, default=0.1)
+    parser.add_argument('--error-tolerance', type=float, default=0.01)
+    args = parser.parse_args()
+
+    services = [s.strip() for s in args.services.split(',') if s.strip()]
+    unknown = set(services) - set(SERVICE_PORTS)
+    if unknown:
+        parser.error(f"unknown services: {', '.join(sorted(unknown))}")
+
+    processes = start_services(services, args.base_port, args.real_postgres, args.log_dir)
+    try:
+        for service, (process, port) in processes.items():
+            if not wait_until_ready(port, args.startup_timeout) or process.poll() is not None:
+                print(f"{service} did not become ready, see {args.log_dir}/{service}.log", file=sys.stderr)
+                return 2
+
+        endpoints = build_mix({service: port for service, (_, port) in processes.items()})
+        samples = run_load(endpoints, args.rps, args.duration, args.warmup, args.concurrency, args.seed)
+    finally:
+        stop_services(processes)
+
+    results = summarize(samples, args.duration)
+    results['meta'] = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'services': services,
+        'rps': args.rps,
+        'duration': args.duration,
+        'warmup': args.warmup,
+        'concurrency': args.concurrency,
+        'seed': args.seed,
+        'real_postgres': args.real_postgres,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+    }
+
+    payload = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(payload + '\n')
+    else:
+        print(payload)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(payload + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.latency_tolerance,
+                              args.throughput_tolerance, args.error_tolerance)
+        if regressions:
+            print("Performance regressions against baseline:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  - {regression}", file=sys.stderr)
+            return 1
+        print("No regressions against baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Serve one service under gunicorn with its dependencies replaced by local stand-ins
+
+The service's own gunicorn-config.py is loaded, only the bind address is overridden,
+so the worker model being measured is the one that ships.
+
+Usage:
+    python benchmarks/serve.py <catalog|frontend|order|search> --port 15001 [--real-postgres]
+"""
+import argparse
+import os
+import sys
+
+from gunicorn.app.base import Application
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'app')
+SERVICES = ('catalog', 'frontend', 'order', 'search')
+
+sys.path.insert(0, BENCH_DIR)
+import standins  # noqa: E402
+
+
+class BenchmarkApplication(Application):
+    """Gunicorn application that installs stand-ins before importing the service"""
+
+    def __init__(self, service, port, real_postgres=False):
+        self.service = service
+        self.port = port
+        self.real_postgres = real_postgres
+        self.service_dir = os.path.join(APP_DIR, service)
+        super().__init__()
+
+    def load_config(self):
+        self.load_config_from_file(os.path.join(self.service_dir, 'gunicorn-config.py'))
+        self.cfg.set('bind', f'127.0.0.1:{self.port}')
+        self.cfg.set('accesslog', None)
+
+    def init(self, parser, opts, args):
+        return None
+
+    def load(self):
+        if not self.real_postgres:
+            standins.install_fake_postgres()
+        standins.install_fake_broker()
+        sys.path.insert(0, self.service_dir)
+        import app
+        return app.application
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('service', choices=SERVICES)
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--real-postgres', action='store_true',
+                        help='use the Postgres configured through POSTGRES_* instead of the fake')
+    args = parser.parse_args()
+
+    # All load comes from one client, so per-client rate limits would only measure the bucket
+    os.environ.setdefault('RATE_LIMIT_RPS', '0')
+
+    # Services read relative paths (e.g. data/search_data.json) from their own directory
+    os.chdir(os.path.join(APP_DIR, args.service))
+
+    if args.service == 'search':
+        # Started in the master so every worker shares one stub
+        server = standins.start_stub_elasticsearch()
+        os.environ['ELASTICSEARCH_HOST'] = '127.0.0.1'
+        os.environ['ELASTICSEARCH_PORT'] = str(server.server_address[1])
+
+    BenchmarkApplication(args.service, args.port, args.real_postgres).run()
+
+
+if __name__ == '__main__':
+    main()
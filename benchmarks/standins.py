@@ -0,0 +1,235 @@
+"""
+Local stand-ins for the services' external dependencies
+
+Used by serve.py so a service can be benchmarked without a cluster:
+- Postgres: in-process fake for psycopg2 (order) and an in-memory SQLite engine
+  for SQLAlchemy (catalog)
+- RabbitMQ: fake pika.BlockingConnection that keeps published messages in memory
+- Elasticsearch: stub HTTP server speaking enough of the REST API for the search service
+
+Each stand-in adds a fixed latency so results resemble a network round trip.
+Latencies are configured in milliseconds through BENCH_DB_LATENCY_MS,
+BENCH_BROKER_LATENCY_MS and BENCH_ES_LATENCY_MS.
+"""
+import collections
+import json
+import os
+import threading
+import urllib.parse
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DB_LATENCY = float(os.getenv('BENCH_DB_LATENCY_MS', '2')) / 1000
+BROKER_LATENCY = float(os.getenv('BENCH_BROKER_LATENCY_MS', '1')) / 1000
+ES_LATENCY = float(os.getenv('BENCH_ES_LATENCY_MS', '5')) / 1000
+
+# Captured before any gevent/eventlet monkey-patching: psycopg2 is a C driver that
+# blocks the whole worker, so the Postgres stand-in must not yield to other green threads
+blocking_sleep = time.sleep
+
+# Messages published through the fake broker, bounded so long runs stay flat
+PUBLISHED = collections.deque(maxlen=10000)
+
+
+class FakeCursor:
+    """Cursor for FakePostgresConnection, records statements and returns a single row"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def execute(self, query, params=None):
+        blocking_sleep(DB_LATENCY)
+        self.connection.statements.append((query, params))
+        self.rowcount = 1
+        self._rows = [(1,)]
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+class FakePostgresConnection:
+    """Minimal psycopg2 connection replacement"""
+
+    def __init__(self, *args, **kwargs):
+        blocking_sleep(DB_LATENCY)
+        self.statements = []
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        blocking_sleep(DB_LATENCY)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def install_fake_postgres():
+    """Route psycopg2 and SQLAlchemy connections to in-process stand-ins"""
+    import psycopg2
+    import sqlalchemy
+    from sqlalchemy.pool import StaticPool
+
+    real_create_engine = sqlalchemy.create_engine
+
+    def create_sqlite_engine(*args, **kwargs):
+        return real_create_engine(
+            'sqlite://',
+            poolclass=StaticPool,
+            connect_args={'check_same_thread': False}
+        )
+
+    psycopg2.connect = FakePostgresConnection
+    sqlalchemy.create_engine = create_sqlite_engine
+    # wait_for_db() only needs the host to resolve
+    os.environ['POSTGRES_HOST'] = 'localhost'
+
+
+class FakeChannel:
+    """Channel returned by FakeBlockingConnection"""
+
+    def queue_declare(self, queue, **kwargs):
+        return None
+
+    def confirm_delivery(self):
+        # Publishes below already wait for the broker's round trip
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, **kwargs):
+        time.sleep(BROKER_LATENCY)
+        PUBLISHED.append((routing_key, body, properties))
+
+    def consume(self, queue, **kwargs):
+        # Nothing is delivered to consumers, block like an idle queue
+        threading.Event().wait()
+        yield from ()
+
+    def basic_ack(self, delivery_tag):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeBlockingConnection:
+    """Minimal pika.BlockingConnection replacement"""
+
+    def __init__(self, parameters=None):
+        time.sleep(BROKER_LATENCY)
+        self.is_open = True
+
+    def channel(self):
+        return FakeChannel()
+
+    def close(self):
+        self.is_open = False
+
+
+def install_fake_broker():
+    """Route pika connections to the in-memory broker"""
+    import pika
+
+    pika.BlockingConnection = FakeBlockingConnection
+
+
+def _load_documents():
+    """Build the documents the stub serves from the search service's sample data"""
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'app', 'search', 'data', 'search_data.json')
+    with open(path) as f:
+        data = json.load(f)
+    return [
+        {"_index": "products", "_id": str(item["id"]), "_score": 1.0,
+         "_source": {"name": item["query"]}}
+        for item in data
+    ]
+
+
+class StubElasticsearchHandler(BaseHTTPRequestHandler):
+    """Answers ping, index, bulk and search calls with canned Elasticsearch responses"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    documents = []
+
+    def _send(self, status, payload=None):
+        # Compact like a real Elasticsearch node
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_HEAD(self):
+        self._send(200, {})
+
+    def do_GET(self):
+        self._send(200, {"name": "stub", "version": {"number": "8.11.0"}, "tagline": "You Know, for Search"})
+
+    def do_PUT(self):
+        self._read_body()
+        self._send(200, {"acknowledged": True, "errors": False, "items": []})
+
+    def do_POST(self):
+        self._read_body()
+        time.sleep(ES_LATENCY)
+        path, _, query = self.path.partition('?')
+        if path.endswith('/_search'):
+            self._send(200, self._filter({
+                "took": int(ES_LATENCY * 1000),
+                "timed_out": False,
+                "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+                "hits": {
+                    "total": {"value": len(self.documents), "relation": "eq"},
+                    "max_score": 1.0,
+                    "hits": self.documents
+                }
+            }, urllib.parse.parse_qs(query).get('filter_path')))
+        else:
+            self._send(200, {"acknowledged": True, "errors": False, "items": []})
+
+    @staticmethod
+    def _filter(payload, filter_path):
+        """Apply filter_path at the top level only, which is all the search service uses"""
+        if not filter_path:
+            return payload
+        keys = {path.split('.')[0] for path in filter_path[0].split(',')}
+        return {key: value for key, value in payload.items() if key in keys}
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_elasticsearch(host='127.0.0.1', port=0):
+    """Start the stub Elasticsearch server on a daemon thread and return it"""
+    StubElasticsearchHandler.documents = _load_documents()
+    server = ThreadingHTTPServer((host, port), StubElasticsearchHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,101 @@
+"""
+Admission control under the gthread worker profile that ships
+
+Run with:
+    python -m pytest tests
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVE = os.path.join(ROOT, 'benchmarks', 'serve.py')
+
+sys.path.insert(0, os.path.join(ROOT, 'app', 'order'))
+from utils.admission import AdaptiveLimiter  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get(url, timeout=30):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+
+@pytest.fixture
+def search_service():
+    """The search service under gunicorn with 2 threads and a 100ms Elasticsearch stand-in"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        GUNICORN_WORKER_PROFILE='gthread',
+        GUNICORN_WORKERS='1',
+        GUNICORN_THREADS='2',
+        BENCH_ES_LATENCY_MS='100',
+        ADMISSION_MAX_QUEUE_WAIT_MS='200',
+    )
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    process = subprocess.Popen(
+        [sys.executable, SERVE, 'search', '--port', str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if get(f'{base_url}/readyz', timeout=1)[0] == 200:
+                    break
+            except OSError:
+                pass
+            if time.monotonic() > deadline or process.poll() is not None:
+                pytest.fail('search service did not become ready')
+            time.sleep(0.2)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def test_limit_is_capped_by_worker_threads():
+    """The limit starts at the thread count rather than above what can be in flight"""
+    limiter = AdaptiveLimiter('test', initial=20, min_limit=2, max_limit=4)
+    assert limiter.limit == 4
+
+
+def test_limit_shrinks_below_worker_threads_when_latency_rises():
+    limiter = AdaptiveLimiter('test', initial=4, min_limit=1, max_limit=4)
+    for latency in [0.01] * 50 + [0.2] * 50:
+        assert limiter.try_acquire()
+        limiter.release(latency)
+    assert limiter.limit == 1
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+
+def test_requests_queued_past_budget_are_rejected(search_service):
+    """A flood of 40 concurrent clients on 2 threads: requests that queued over 200ms get 503"""
+    with ThreadPoolExecutor(40) as executor:
+        responses = list(executor.map(lambda _: get(f'{search_service}/search?q=laptop'), range(80)))
+    statuses = Counter(status for status, _ in responses)
+    assert statuses[200] > 0
+    assert statuses[503] > 0
+    assert set(statuses) <= {200, 503}
+
+    _, metrics = get(f'{search_service}/metrics')
+    assert 'reason="queue_timeout"' in metrics